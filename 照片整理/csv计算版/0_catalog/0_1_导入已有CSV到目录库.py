@@ -0,0 +1,37 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import Catalog, HASH_METHODS, catalog_path
+
+
+def import_existing_csv(db_path, md5_csv, imagehash_csv_prefix):
+    """
+    将已有的 MD5 CSV 和 imagehash CSV 导入目录库。
+    :param db_path: 目录库文件路径
+    :param md5_csv: 1_1 生成的 MD5 CSV
+    :param imagehash_csv_prefix: 2_1 生成的 imagehash CSV 前缀（如 ../2_imagehash/处理总文件image）
+    """
+    with Catalog(db_path) as catalog:
+        if os.path.exists(md5_csv):
+            count = catalog.import_md5_csv(md5_csv)
+            print(f"已导入 {md5_csv}，共 {count} 行")
+        else:
+            print(f"文件不存在，跳过: {md5_csv}")
+
+        for hash_method in HASH_METHODS:
+            imagehash_csv = f"{imagehash_csv_prefix}_{hash_method}.csv"
+            if os.path.exists(imagehash_csv):
+                count = catalog.import_imagehash_csv(imagehash_csv, hash_method)
+                print(f"已导入 {imagehash_csv}，共 {count} 行")
+            else:
+                print(f"文件不存在，跳过: {imagehash_csv}")
+
+
+if __name__ == "__main__":
+    for name in ["原始总文件", "处理总文件"]:
+        start_time = time.time()
+        db_path = catalog_path(name)
+        import_existing_csv(db_path, f"../1_md5/{name}md5.csv", f"../2_imagehash/{name}image")
+        print(f"{name} 导入完成，目录库: {db_path}，耗时： {time.time() - start_time} 秒")
@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import DEFAULT_JOURNAL_KEEP_DAYS, Catalog, catalog_path
+
+
+def file_size(db_path):
+    """
+    返回目录库及其 WAL 日志的总大小（字节）
+    """
+    return sum(os.path.getsize(path) for path in (db_path, f"{db_path}-wal") if os.path.exists(path))
+
+
+def compact_catalog(db_path, keep_days=DEFAULT_JOURNAL_KEEP_DAYS):
+    """
+    整理目录库：清理过期的删除日志，合并 WAL 日志并回收空闲空间。
+    删除标记平时只追加日志、修改对应行，不需要每次删除后整理，建议在批量删除之后运行一次。
+    :param keep_days: 删除日志保留天数，为 None 时保留全部
+    """
+    if not os.path.exists(db_path):
+        print(f"目录库不存在，跳过: {db_path}")
+        return
+
+    size_before = file_size(db_path)
+    with Catalog(db_path) as catalog:
+        journal_count = catalog.deletion_journal_count()
+        removed = catalog.compact(keep_days)
+    size_after = file_size(db_path)
+    print(f"删除日志共 {journal_count} 条，清理 {removed} 条")
+    print(f"目录库大小: {size_before / 1024 / 1024:.1f} MB -> {size_after / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    keep_days = DEFAULT_JOURNAL_KEEP_DAYS  # 删除日志保留天数，None 表示全部保留
+    for name in ["原始总文件", "处理总文件"]:
+        start_time = time.time()
+        db_path = catalog_path(name)
+        compact_catalog(db_path, keep_days)
+        print(f"{name} 整理完成，耗时： {time.time() - start_time} 秒")
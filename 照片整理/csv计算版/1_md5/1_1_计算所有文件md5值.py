@@ -1,108 +1,150 @@
 import os
-import hashlib
-import csv
+import sys
 import time
 
 from tqdm import tqdm
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def calculate_md5(file_path):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import Catalog, catalog_path
+from common.dir_tree import is_same_or_under
+from common.disk_order import iter_physical_order
+from common.hashing import calculate_digest
+from common.pipeline import split_folders, walk_directories
+from common.scheduler import group_folders_by_device, run_device_pipeline
+
+def process_file(task, algorithm="md5"):
     """
-    计算文件的 MD5 值
+    多线程任务：计算文件摘要并返回待写入的行，已知摘要的文件不再读取
     """
-    hash_md5 = hashlib.md5()
-    try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    except Exception as e:
-        print(f"无法计算文件 {file_path} 的 MD5，错误: {e}")
-        return None
-    finally:
-        f.close()  # 确保文件被关闭
+    file_name, directory, file_path, file_stat, md5 = task
+    if md5 is None:
+        md5 = calculate_digest(file_path, algorithm)
+        if md5 is None:
+            return None
+    return (md5, file_name, directory, file_path, 0, *file_stat)
 
-def process_file(file_path):
+def iter_changed_files(folder_paths, db_path, summary, incremental=True, algorithm="md5"):
     """
-    多线程任务：计算文件 MD5 并返回结果
+    生产者：逐个目录遍历文件夹，增量模式下与目录库中该目录上次的状态比对，只产出需要写入的文件。
+    每项为 (文件名, 文件目录, 文件路径, 属性, 已知摘要)，已知摘要不为空时无需重新计算。
+    路径、大小、修改时间、inode、摘要算法都未变化的文件直接跳过；
+    上次存在、本次未找到的文件路径记入 summary["vanished"]。
+    无法读取属性的文件记入 summary["failed"]，无法列出的目录记入 summary["failed_dirs"]，它们不算已消失。
     """
-    md5 = calculate_md5(file_path)
-    return md5, file_path
+    # 在生产者线程中单独打开一个只读连接，只加载当前目录的上次状态
+    catalog = Catalog(db_path) if incremental else None
+    try:
+        for root, entries in walk_directories(folder_paths, failed=summary["failed"],
+                                             failed_dirs=summary["failed_dirs"]):
+            summary["dirs"].add(root)
+            previous = catalog.load_directory_state(root) if catalog else {}
+            for file_name, file_path, file_stat in entries:
+                summary["found"] += 1
+                state = previous.pop(file_path, None)
+                if state:
+                    size, mtime, inode, md5, deleted, hash_algo = state
+                    if md5 and hash_algo == algorithm and (size, mtime, inode) == file_stat[:3]:
+                        summary["reused"] += 1
+                        if deleted:  # 之前标记为删除的文件又出现了
+                            yield file_name, root, file_path, file_stat, md5
+                        continue
+                yield file_name, root, file_path, file_stat, None
+            # 读取属性失败（如文件被占用）的文件仍然存在，不标记为删除
+            for file_path in [path for path in previous if path in summary["failed"]]:
+                previous.pop(file_path)
+            summary["vanished"].extend(path for path, state in previous.items() if not state[4])
+    finally:
+        if catalog:
+            catalog.close()
 
-def process_folders(folder_paths, num_threads=None):
+def process_folders(folder_paths, db_path, max_threads=64, incremental=True, algorithm="md5", queue_size=1024,
+                    hdd_mode=False, hdd_readers=1):
     """
-    遍历多个文件夹并计算文件 MD5 值（支持多线程，线程数可配置）
+    遍历多个文件夹并计算文件 MD5 值（多线程），边计算边写入目录库。
+    文件夹按所在设备分组，每个设备有独立的遍历线程和工作线程组，不同设备并行读取；
+    每个设备的线程数根据实测吞吐量在 1 到 max_threads 之间自动调整（机械硬盘少、固态硬盘多）。
+    计算结果由写入线程（当前线程）按完成顺序分批写入，内存占用与文件总数无关。
+    algorithm 可选 md5、blake2b，以及已安装时的 xxhash、blake3，默认 md5 以兼容已有结果。
+    incremental 为 True 时只计算新增或变化的文件，并把已消失的文件标记为删除。
+    hdd_mode 为 True 时（机械硬盘）文件按物理位置（FIEMAP 或 inode）排序，每个设备固定 hdd_readers 个线程顺序读取。
     """
-    results = []
-    file_paths = []
-
-    # 收集所有文件路径
-    for folder in folder_paths.split(";"):
-        folder = folder.strip()
-        if not os.path.exists(folder) or not os.path.isdir(folder):
-            print(f"无效的文件夹路径: {folder}")
-            continue
-
-        for root, _, files in os.walk(folder):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                file_paths.append((file_name, root, file_path))
-
-    print(f"共找到 {len(file_paths)} 个文件，开始计算 MD5...")
+    device_groups = group_folders_by_device(folder_paths)
+    summaries = {device: {"found": 0, "reused": 0, "vanished": [], "dirs": set(), "failed": set(), "failed_dirs": set()}
+                 for device in device_groups}
+    sources = {
+        device: iter_changed_files(folders, db_path, summaries[device], incremental=incremental, algorithm=algorithm)
+        for device, folders in device_groups.items()
+    }
+    if hdd_mode:
+        sources = {device: iter_physical_order(tasks, lambda task: task[2], lambda task: task[3][2])
+                   for device, tasks in sources.items()}
+        results = run_device_pipeline(sources, lambda task: process_file(task, algorithm),
+                                      initial_workers=hdd_readers, min_workers=hdd_readers, max_workers=hdd_readers,
+                                      queue_size=queue_size)
+    else:
+        results = run_device_pipeline(sources, lambda task: process_file(task, algorithm),
+                                      size_of=lambda task: task[3][0], max_workers=max_threads,
+                                      queue_size=queue_size)
 
-    # 使用多线程计算 MD5，并显示进度条
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        future_to_file = {executor.submit(calculate_md5, file_path[2]): file_path for file_path in file_paths}
-        for future in tqdm(as_completed(future_to_file), total=len(future_to_file), desc="计算 MD5 值", unit="文件"):
-            try:
-                md5 = future.result()
-                if md5:
-                    file_name, directory, file_path = future_to_file[future]
-                    results.append((md5, file_name, directory, file_path, 0))
-            except Exception as e:
-                print(f"处理文件时出错: {e}")
+    with Catalog(db_path) as catalog:
+        written = catalog.upsert_md5(tqdm(results, desc="计算 MD5 值", unit="文件"), hash_algo=algorithm)
 
-    return results
+        summary = {"found": 0, "reused": 0, "vanished": [], "dirs": set(), "failed": set(), "failed_dirs": set()}
+        for device_summary in summaries.values():
+            summary["found"] += device_summary["found"]
+            summary["reused"] += device_summary["reused"]
+            summary["vanished"].extend(device_summary["vanished"])
+            summary["dirs"].update(device_summary["dirs"])
+            summary["failed"].update(device_summary["failed"])
+            summary["failed_dirs"].update(device_summary["failed_dirs"])
 
-def save_to_csv(data, output_file):
-    """
-    将结果保存为 CSV 文件
-    """
-    with open(output_file, mode="w", newline="", encoding="utf-8") as csv_file:
-        writer = csv.writer(csv_file)
-        # 写入表头
-        writer.writerow(["MD5", "文件名", "文件目录", "文件路径", "是否删除"])
+        if incremental:
+            # 整个目录都已不存在的文件（只看本次成功遍历的文件夹，避免磁盘未挂载时误标；
+            # 无法列出的目录及其子目录下的文件不算已消失）
+            folders = [folder for group in device_groups.values() for folder in split_folders(group)]
+            summary["vanished"].extend(
+                path for path, directory in catalog.iter_paths_under(folders)
+                if directory not in summary["dirs"]
+                and not any(is_same_or_under(directory, failed_dir) for failed_dir in summary["failed_dirs"]))
+            catalog.mark_deleted(summary["vanished"])
 
-        # 写入内容
-        writer.writerows(data)
+    print(f"共找到 {summary['found']} 个文件，其中 {summary['reused']} 个未变化，写入 {written} 个文件")
+    if summary["vanished"]:
+        print(f"{len(summary['vanished'])} 个文件已不存在，已标记为删除")
+    if summary["failed"] or summary["failed_dirs"]:
+        print(f"{len(summary['failed'])} 个文件、{len(summary['failed_dirs'])} 个目录读取失败，保留其在目录库中的记录")
+    return summary
 
 if __name__ == "__main__":
-    num_threads = 64
+    max_threads = 64  # 每个设备的最大线程数，实际线程数按吞吐量自动调整
+    incremental = True  # 增量模式：只计算新增或变化的文件，首次运行时目录库为空，等同于全量扫描
+    algorithm = "md5"  # 摘要算法，可选 md5、blake2b、xxhash、blake3（后两种需安装对应模块）
+    hdd_mode = True  # 处理文件（J:\机械*）在机械硬盘上，按物理顺序单线程读取
 
     # 原始文件
     input_folders = r"D:\JisuCloud;D:\BaiduNetdiskDownload\pc08803;D:\BaiduNetdiskDownload\PS;D:\BaiduNetdiskDownload\相册·2;D:\桌面;F:\FileRecv;G:\尘封的回忆;K:\BaiduNetdiskDownload"
-    output_csv = "原始总文件md5.csv"  # 输出文件名
+    output_db = catalog_path("原始总文件")  # 输出目录库
     if not input_folders:
         print("未输入有效的目录路径，程序退出。")
     else:
         start_time = time.time()
-        results = process_folders(input_folders, num_threads=num_threads)
-        save_to_csv(results, output_csv)
-        print(f"处理完成，结果已保存到 {output_csv}")
+        process_folders(input_folders, output_db, max_threads=max_threads, incremental=incremental,
+                        algorithm=algorithm)
+        print(f"处理完成，结果已保存到 {output_db}")
         end_time = time.time()
         elapsed_time = end_time - start_time
         print(f"原始文件处理耗时： {elapsed_time} 秒")
 
     # 处理文件
     input_folders = r"I:\BaiduNetdiskDownload;J:\机械D;J:\机械F;J:\机械G"
-    output_csv = "处理总文件md5.csv"  # 输出文件名
+    output_db = catalog_path("处理总文件")  # 输出目录库
     if not input_folders:
         print("未输入有效的目录路径，程序退出。")
     else:
         start_time = time.time()
-        results = process_folders(input_folders, num_threads=num_threads)
-        save_to_csv(results, output_csv)
-        print(f"处理完成，结果已保存到 {output_csv}")
+        process_folders(input_folders, output_db, max_threads=max_threads, incremental=incremental,
+                        algorithm=algorithm, hdd_mode=hdd_mode)
+        print(f"处理完成，结果已保存到 {output_db}")
         end_time = time.time()
         elapsed_time = end_time - start_time
         print(f"处理文件处理耗时： {elapsed_time} 秒")
\ No newline at end of file
@@ -1,23 +1,24 @@
+import os
+import sys
 import csv
 from collections import defaultdict
 
-def process_md5_csv(input_csv, output_csv, count_dir = None):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import Catalog, catalog_path
+
+def process_md5_csv(db_path, output_csv, count_dir = None):
     """
-    根据输入的 MD5 文件，输出目标格式。
+    根据目录库中的 MD5 记录，输出目标格式。
     """
     # 用于存储 MD5 和对应文件信息的字典
     md5_dict = defaultdict(list)
 
-    # 读取输入 CSV 文件
-    with open(input_csv, mode="r", encoding="utf-8") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row["是否删除"] == "0":  # 仅处理未删除的文件
-                if count_dir:
-                    if row["文件目录"].startswith(count_dir):
-                        md5_dict[row["MD5"]].append(row)
-                else:
-                    md5_dict[row["MD5"]].append(row)
+    # 读取目录库（仅处理未删除的文件）
+    with Catalog(db_path) as catalog:
+        # 指定目录时只按文件路径索引读取该目录下的文件
+        rows = catalog.iter_md5_rows_under(count_dir) if count_dir else catalog.iter_md5_rows()
+        for row in rows:
+            md5_dict[row["MD5"]].append(row)
 
     # 准备输出内容
     output_data = []
@@ -70,7 +71,7 @@ def process_md5_csv(input_csv, output_csv, count_dir = None):
 
 if __name__ == "__main__":
     # 示例调用
-    input_csv = "处理总文件md5.csv"  # 输入文件
+    db_path = catalog_path("处理总文件")  # 输入目录库
     output_csv = "按md5统计.csv"  # 输出文件
     count_dir = input("请输入需要统计文件的目录（可为空）: ").strip() or None
-    process_md5_csv(input_csv, output_csv, count_dir)
+    process_md5_csv(db_path, output_csv, count_dir)
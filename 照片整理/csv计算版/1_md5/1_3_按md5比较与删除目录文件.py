@@ -1,86 +1,104 @@
 import os
+import sys
 import csv
-import send2trash
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
+from collections import defaultdict
+from operator import itemgetter
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import Catalog, catalog_path
+from common.dir_tree import DirectoryTree, is_same_or_under, print_directory_stats
+from common.trash import DEFAULT_WORKERS_PER_DEVICE, trash_files
 
-import chardet
-
-def read_csv_with_auto_encoding(csv_path):
+def read_catalog(db_path):
     """
-    自动检测文件编码并读取 CSV 文件。
-    读取 CSV 文件，返回未删除的记录。
+    读取目录库，返回未删除的记录。
     """
-    data = []
     try:
-        # 使用检测到的编码读取文件
-        with open(csv_path, mode="r", encoding="utf-8") as csv_file:
-            reader = csv.DictReader(csv_file)
-            for row in reader:
-                if row["是否删除"] == "0":
-                    data.append(row)
-        return data
+        with Catalog(db_path) as catalog:
+            return list(catalog.iter_md5_rows())
     except Exception as e:
-        print(f"读取 CSV 文件失败: {e}")
+        print(f"读取目录库失败: {e}")
         return None
 
-def filter_files_by_directories(data, dir1, dir2):
+def build_directory_tree(data):
     """
-    筛选出属于给定两个目录的文件。
+    把记录按目录放入前缀树，只遍历一次全部记录；之后每次筛选只访问相关子树。
+    树中的值为 (在目录库中的顺序, 文件信息)。
     """
-    dir1_files = []
-    dir2_files = []
-    for row in data:
-        file_path = row["文件路径"]
-        # dir1是dir2的父目录
-        if dir2.startswith(dir1):
-            if file_path.startswith(dir2):
-                dir2_files.append(row)
-            elif file_path.startswith(dir1):
-                dir1_files.append(row)
-        elif dir1.startswith(dir2):
-            if file_path.startswith(dir1):
-                dir1_files.append(row)
-            elif file_path.startswith(dir2):
-                dir2_files.append(row)
-        else:
-            if file_path.startswith(dir1):
-                dir1_files.append(row)
-            elif file_path.startswith(dir2):
-                dir2_files.append(row)
+    tree = DirectoryTree()
+    for position, row in enumerate(data):
+        tree.add(row["文件目录"], row["文件路径"], (position, row))
+    return tree
+
+
+def filter_files_by_directories(tree, dir1, dir2):
+    """
+    筛选出属于给定两个目录的文件；一个目录是另一个的子目录时，子目录的文件不计入父目录。
+    :param tree: build_directory_tree 的结果
+    """
+    # dir1是dir2的父目录
+    if is_same_or_under(dir2, dir1):
+        dir1_items, dir2_items = tree.iter_under(dir1, exclude=[dir2]), tree.iter_under(dir2)
+    elif is_same_or_under(dir1, dir2):
+        dir1_items, dir2_items = tree.iter_under(dir1), tree.iter_under(dir2, exclude=[dir1])
+    else:
+        dir1_items, dir2_items = tree.iter_under(dir1), tree.iter_under(dir2)
+    # 恢复目录库中的顺序
+    dir1_files = [row for _, row in sorted(dir1_items, key=itemgetter(0))]
+    dir2_files = [row for _, row in sorted(dir2_items, key=itemgetter(0))]
     return dir1_files, dir2_files
 
 
 def compare_files(dir1_files, dir2_files):
     """
     比较两个目录的文件 MD5 和文件名，返回独有文件和 MD5、文件名都相同的文件信息。
+    以 MD5 为键做哈希连接，耗时与两个目录的文件数之和成正比。
     """
+    # dir2 中每个 MD5 对应的第一个文件
+    dir2_by_md5 = {}
+    for row in dir2_files:
+        dir2_by_md5.setdefault(row["MD5"], row)
     dir1_md5_set = {row["MD5"] for row in dir1_files}
-    dir2_md5_set = {row["MD5"] for row in dir2_files}
 
-    unique_to_dir1 = [row for row in dir1_files if row["MD5"] not in dir2_md5_set]
+    unique_to_dir1 = [row for row in dir1_files if row["MD5"] not in dir2_by_md5]
     unique_to_dir2 = [row for row in dir2_files if row["MD5"] not in dir1_md5_set]
 
-    dir2_md5_name_set = {(row["MD5"], row["文件名"]) for row in dir2_files}
     # 获取 MD5 都相同的文件
     same_files = []
     for row1 in dir1_files:
-        for row2 in dir2_files:
-            if row1["MD5"] == row2["MD5"]:
-                same_files.append({
-                    "MD5": row1["MD5"],
-                    "文件名1": row1["文件名"],
-                    "文件名2": row2["文件名"],
-                    "名称是否相同": "1" if row1["文件名"] == row2["文件名"] else "0",
-                    "文件目录1": row1["文件目录"],
-                    "文件目录2": row2["文件目录"],
-                })
-                break  # 找到匹配的 MD5 后跳出内层循环
+        row2 = dir2_by_md5.get(row1["MD5"])
+        if row2 is not None:
+            same_files.append({
+                "MD5": row1["MD5"],
+                "文件名1": row1["文件名"],
+                "文件名2": row2["文件名"],
+                "名称是否相同": "1" if row1["文件名"] == row2["文件名"] else "0",
+                "文件目录1": row1["文件目录"],
+                "文件目录2": row2["文件目录"],
+                "文件路径1": row1["文件路径"],
+                "文件路径2": row2["文件路径"],
+            })
 
     return unique_to_dir1, unique_to_dir2, same_files
 
 
+def parse_directory_pairs(dir):
+    """
+    解析多行目录配置，每行为 "目录1;目录2[;删除目录]"
+    :return: [(目录1, 目录2, 删除目录或 None), ...]
+    """
+    pairs = []
+    for sub_dir in dir.split("\n"):
+        single_dir_list = sub_dir.split(";")
+        dir1 = single_dir_list[0].strip()
+        dir2 = single_dir_list[1].strip() if len(single_dir_list) > 1 else ""
+        delete_dir = None
+        if len(single_dir_list) > 2:
+            delete_dir = single_dir_list[2].strip() or None
+        pairs.append((dir1, dir2, delete_dir))
+    return pairs
+
+
 def save_to_csv(data, output_file):
     """
     将结果保存为 CSV 文件。
@@ -102,106 +120,176 @@ def save_same_to_csv(data, output_file):
     try:
         with open(output_file, mode="w", newline="", encoding="utf-8") as csv_file:
             writer = csv.writer(csv_file)
-            writer.writerow(["MD5", "文件名1", "文件名2", "名称是否相同", "文件目录1", "文件目录2"])
+            writer.writerow(["MD5", "文件名1", "文件名2", "名称是否相同", "文件目录1", "文件目录2", "文件路径1", "文件路径2"])
             for row in data:
-                writer.writerow([row["MD5"], row["文件名1"], row["文件名2"], row["名称是否相同"], row["文件目录1"], row["文件目录2"]])
+                writer.writerow([row["MD5"], row["文件名1"], row["文件名2"], row["名称是否相同"], row["文件目录1"], row["文件目录2"],
+                                 row["文件路径1"], row["文件路径2"]])
         print(f"结果已保存到 {output_file}")
     except Exception as e:
         print(f"保存 CSV 文件失败: {e}")
 
-def delete_files_with_same_md5(data, delete_dir, compare_dir, csv_path, num_threads=4):
+def plan_deletions(tree, rules):
     """
-    删除 delete_dir 中与 compare_dir 中有相同 MD5 的文件，并更新 CSV 文件。
+    根据所有删除规则计算全局删除计划，与依次执行各规则的结果一致：
+    按顺序处理规则，每条规则删除 delete_dir 中与 compare_dir 里尚未计划删除的文件有相同 MD5 的文件。
+    每个被删除的文件在其比较目录中都保留着至少一个相同的文件，因此每个 MD5 至少保留一个文件。
+    文件在比较目录中的相同文件都已被之前的规则计划删除时（如 A、B 两个目录互相删除）保留该文件，记为冲突。
+    :param tree: build_directory_tree 的结果
+    :param rules: [(规则编号, 删除目录, 比较目录), ...]，按执行顺序排列
+    :return: (删除计划 [{"规则", "MD5", "文件路径", "删除目录", "比较目录"}, ...],
+              冲突 [{"MD5", "文件数", "保留文件", "涉及规则"}, ...]，文件数为比较目录中已计划删除的相同文件数)
     """
+    # 文件路径 -> 计划删除该文件的规则编号
+    planned = {}
+    plan = []
+    conflicts = []
+    for rule_id, delete_dir, compare_dir in rules:
+        delete_dir_files, compare_dir_files = filter_files_by_directories(tree, delete_dir, compare_dir)
+        remaining_md5_set = set()
+        planned_rules_by_md5 = defaultdict(list)
+        for row in compare_dir_files:
+            planned_rule = planned.get(row["文件路径"])
+            if planned_rule is None:
+                remaining_md5_set.add(row["MD5"])
+            else:
+                planned_rules_by_md5[row["MD5"]].append(planned_rule)
+
+        for row in delete_dir_files:
+            if row["文件路径"] in planned:
+                continue
+            if row["MD5"] in remaining_md5_set:
+                planned[row["文件路径"]] = rule_id
+                plan.append({"规则": rule_id, "MD5": row["MD5"], "文件路径": row["文件路径"], "删除目录": delete_dir,
+                             "比较目录": compare_dir})
+            elif row["MD5"] in planned_rules_by_md5:
+                earlier_rules = planned_rules_by_md5[row["MD5"]]
+                conflicts.append({
+                    "MD5": row["MD5"],
+                    "文件数": len(earlier_rules),
+                    "保留文件": row["文件路径"],
+                    "涉及规则": ",".join(str(planned_rule) for planned_rule in sorted(set(earlier_rules) | {rule_id})),
+                })
+    return plan, conflicts
 
-    delete_dir_files, compare_dir_files = filter_files_by_directories(data, delete_dir, compare_dir)
-    # 获取 compare_dir 的 MD5 集合
-    compare_md5_set = {row["MD5"] for row in compare_dir_files}
-
-    # 筛选出 delete_dir 中 MD5 相同的文件
-    delete_tasks = [
-        row for row in delete_dir_files if row["MD5"] in compare_md5_set
-    ]
-
-    if not delete_tasks:
-        print(f"未找到需要删除的文件，目录 {delete_dir} 中没有与目录 {compare_dir} 相同的文件。")
-        return
 
-    # 删除文件并显示进度
-    progress_bar = tqdm(total=len(delete_tasks), desc="删除文件", unit="文件")
-    success_count = 0  # 成功删除文件的计数器
-
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        futures = {executor.submit(send2trash.send2trash, row["文件路径"]): row for row in delete_tasks}
-        for future in as_completed(futures):
-            row = futures[future]
-            # 更新 CSV 中的 "是否删除" 列
-            row["是否删除"] = "1"
-            try:
-                future.result()
-                progress_bar.update(1)
-                success_count += 1  # 成功删除文件计数加一
-            except Exception as e:
-                print(f"删除文件失败: {row['文件路径']}，错误: {e}")
-    progress_bar.close()
-
-    # 更新 CSV 文件
+def save_plan_to_csv(plan, conflicts, plan_output_csv, conflicts_output_csv):
+    """
+    保存删除计划和冲突
+    """
     try:
-        with open(csv_path, mode="w", newline="", encoding="utf-8") as csv_file:
-            fieldnames = ["MD5", "文件名", "文件目录", "文件路径", "是否删除"]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+        with open(plan_output_csv, mode="w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=["规则", "MD5", "文件路径", "删除目录", "比较目录"])
             writer.writeheader()
-            writer.writerows(data)
-        print(f"CSV 文件已更新: {csv_path}")
+            writer.writerows(plan)
+        print(f"删除计划已保存到 {plan_output_csv}")
+        with open(conflicts_output_csv, mode="w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=["MD5", "文件数", "保留文件", "涉及规则"])
+            writer.writeheader()
+            writer.writerows(conflicts)
+        print(f"删除冲突已保存到 {conflicts_output_csv}")
     except Exception as e:
-        print(f"更新 CSV 文件失败: {e}")
+        print(f"保存 CSV 文件失败: {e}")
+
+
+def execute_plan(plan, db_path, workers_per_device=DEFAULT_WORKERS_PER_DEVICE):
+    """
+    一次性执行删除计划：按目录分批移入回收站，每个设备的并发数有上限，最后一次性更新目录库。
+    """
+    if not plan:
+        print("删除计划为空，没有需要删除的文件。")
+        return
+
+    deleted_paths, missing_paths, failures = trash_files([item["文件路径"] for item in plan], db_path,
+                                                         workers_per_device=workers_per_device)
 
     # 输出成功删除的文件总数
-    print(f"应删除文件数：{len(delete_tasks)}，成功删除了 {success_count} 个文件。")
+    print(f"应删除文件数：{len(plan)}，成功删除了 {len(deleted_paths)} 个文件，"
+          f"文件不存在 {len(missing_paths)} 个，失败 {len(failures)} 个。")
 
-def start_with_str(csv_file_path, unique_files_output_csv, same_files_output_csv, dir, num_threads):
-    count = 0
-    for sub_dir in dir.split("\n"):
-        count += 1
-        single_dir_list = sub_dir.split(";")
-        dir1 = single_dir_list[0].strip()
-        dir2 = single_dir_list[1].strip()
-        delete_dir = None
-        if len(single_dir_list) > 2:
-            delete_dir = single_dir_list[2].strip()
 
+def run_deletion_plan(tree, rules, db_path, plan_output_csv, conflicts_output_csv, workers_per_device,
+                      dry_run=False):
+    """
+    计算并保存删除计划，dry_run 为 True 时只输出计划不删除
+    """
+    if not rules:
+        return
+    plan, conflicts = plan_deletions(tree, rules)
+    for rule_id, delete_dir, compare_dir in rules:
+        count = sum(1 for item in plan if item["规则"] == rule_id)
+        print(f"规则 {rule_id}：删除目录【{delete_dir}】中与【{compare_dir}】相同的文件 {count} 个")
+    print(f"共计划删除 {len(plan)} 个文件，冲突 {len(conflicts)} 个文件（比较目录中的相同文件已被之前的规则删除，已保留）")
+    save_plan_to_csv(plan, conflicts, plan_output_csv, conflicts_output_csv)
+    if dry_run:
+        print("仅预览删除计划，未删除文件")
+    else:
+        execute_plan(plan, db_path, workers_per_device=workers_per_device)
+
+
+def compare_directory_pair(tree, db_path, dir1, dir2, unique_files_output_csv, same_files_output_csv):
+    """
+    比较一对目录并保存结果
+    """
+    print_directory_stats(db_path, [dir1, dir2])
+
+    # 筛选文件
+    dir1_files, dir2_files = filter_files_by_directories(tree, dir1, dir2)
+    print(f"目录【{dir1}】文件数为： {len(dir1_files)}")
+    print(f"目录【{dir2}】文件数为： {len(dir2_files)}")
+
+    # 比较文件
+    unique_to_dir1, unique_to_dir2, same_files = compare_files(dir1_files, dir2_files)
+    print(f"目录【{dir1}】独有文件数为： {len(unique_to_dir1)}")
+    print(f"目录【{dir2}】独有文件数为： {len(unique_to_dir2)}")
+    print(f"目录【{dir1}&{dir2}】完全相同的文件数为： {len(same_files)}")
+
+    # 保存独有文件到 CSV
+    save_to_csv(unique_to_dir1 + unique_to_dir2, unique_files_output_csv)
+    save_same_to_csv(same_files, same_files_output_csv)
+
+
+def deletion_rule(rule_id, dir1, dir2, delete_dir):
+    """
+    把删除目录转换为删除规则 (规则编号, 删除目录, 比较目录)，删除目录无效时返回 None
+    """
+    if not delete_dir:
+        return None
+    if delete_dir not in [dir1, dir2]:
+        print("删除目录必须是给定的两个目录之一！")
+        return None
+    return rule_id, delete_dir, dir1 if delete_dir == dir2 else dir2
+
+
+def start_with_str(db_path, unique_files_output_csv, same_files_output_csv, plan_output_csv, conflicts_output_csv,
+                   dir, workers_per_device, dry_run=False):
+    """
+    批量比较多对目录：目录库只读取一次并建立目录树一次，所有目录对都基于同一份目录库比较，
+    再汇总所有删除规则计算全局删除计划，一次性执行。
+    """
+    data = read_catalog(db_path)
+    if data is None:
+        return
+    tree = build_directory_tree(data)
+
+    rules = []
+    for count, (dir1, dir2, delete_dir) in enumerate(parse_directory_pairs(dir), start=1):
         if not dir1 or not dir2:
             print("请输入有效的目录路径！")
         elif dir1 == dir2:
             print("比较目录不能是同一个！")
         else:
-            data = read_csv_with_auto_encoding(csv_file_path)
-
-            # 筛选文件
-            dir1_files, dir2_files = filter_files_by_directories(data, dir1, dir2)
-            print(f"目录【{dir1}】文件数为： {len(dir1_files)}")
-            print(f"目录【{dir2}】文件数为： {len(dir2_files)}")
-
-            # 比较文件
-            unique_to_dir1, unique_to_dir2, same_files = compare_files(dir1_files, dir2_files)
-            print(f"目录【{dir1}】独有文件数为： {len(unique_to_dir1)}")
-            print(f"目录【{dir2}】独有文件数为： {len(unique_to_dir2)}")
-            print(f"目录【{dir1}&{dir2}】完全相同的文件数为： {len(same_files)}")
-
-            # 保存独有文件到 CSV
-            save_to_csv(unique_to_dir1 + unique_to_dir2, unique_files_output_csv.replace(".csv", "_"+str(count)+".csv"))
-            save_same_to_csv(same_files, same_files_output_csv.replace(".csv", "_"+str(count)+".csv"))
-
-            # 删除相同文件并更新 CSV
-            if delete_dir:
-                if delete_dir not in [dir1, dir2]:
-                    print("删除目录必须是给定的两个目录之一！")
-                else:
-                    compare_dir = dir1 if delete_dir == dir2 else dir2
-                    delete_files_with_same_md5(data, delete_dir, compare_dir, csv_file_path, num_threads=num_threads)
+            compare_directory_pair(tree, db_path, dir1, dir2,
+                                   unique_files_output_csv.replace(".csv", "_"+str(count)+".csv"),
+                                   same_files_output_csv.replace(".csv", "_"+str(count)+".csv"))
+            rule = deletion_rule(count, dir1, dir2, delete_dir)
+            if rule:
+                rules.append(rule)
         print("=============================================================================================================")
 
-def start_with_input(csv_file_path, unique_files_output_csv, same_files_output_csv, dir, num_threads):
+    run_deletion_plan(tree, rules, db_path, plan_output_csv, conflicts_output_csv, workers_per_device, dry_run)
+
+def start_with_input(db_path, unique_files_output_csv, same_files_output_csv, plan_output_csv, conflicts_output_csv,
+                     dir, workers_per_device, dry_run=False):
     dir1 = dir.split(";")[0].strip()
     dir2 = dir.split(";")[1].strip()
     delete_dir = input("请输入需要删除文件的目录（可为空）: ").strip() or None
@@ -211,31 +299,15 @@ def start_with_input(csv_file_path, unique_files_output_csv, same_files_output_c
     elif dir1 == dir2:
         print("比较目录不能是同一个！")
     else:
-        data = read_csv_with_auto_encoding(csv_file_path)
-
-        # 筛选文件
-        dir1_files, dir2_files = filter_files_by_directories(data, dir1, dir2)
-        print(f"目录【{dir1}】文件数为： {len(dir1_files)}")
-        print(f"目录【{dir2}】文件数为： {len(dir2_files)}")
-
-        # 比较文件
-        unique_to_dir1, unique_to_dir2, same_files = compare_files(dir1_files, dir2_files)
-        print(f"目录【{dir1}】独有文件数为： {len(unique_to_dir1)}")
-        print(f"目录【{dir2}】独有文件数为： {len(unique_to_dir2)}")
-        print(f"目录【{dir1}&{dir2}】完全相同的文件数为： {len(same_files)}")
-
-        # 保存独有文件到 CSV
-        save_to_csv(unique_to_dir1 + unique_to_dir2, unique_files_output_csv)
-        save_same_to_csv(same_files, same_files_output_csv)
-
-        # 删除相同文件并更新 CSV
-        if delete_dir:
-            if delete_dir not in [dir1, dir2]:
-                print("删除目录必须是给定的两个目录之一！")
-            else:
-                compare_dir = dir1 if delete_dir == dir2 else dir2
-                delete_files_with_same_md5(data, delete_dir, compare_dir, csv_file_path, num_threads=num_threads)
-
+        data = read_catalog(db_path)
+        if data is None:
+            return
+        tree = build_directory_tree(data)
+        compare_directory_pair(tree, db_path, dir1, dir2, unique_files_output_csv, same_files_output_csv)
+        rule = deletion_rule(1, dir1, dir2, delete_dir)
+        if rule:
+            run_deletion_plan(tree, [rule], db_path, plan_output_csv, conflicts_output_csv, workers_per_device,
+                              dry_run)
 
 if __name__ == "__main__":
     dir = r'''I:\BaiduNetdiskDownload\微信图片备份;I:\BaiduNetdiskDownload\来自：NX563J\WeiXin;I:\BaiduNetdiskDownload\微信图片备份
@@ -268,11 +340,16 @@ J:\机械D\JisuCloud\摄图网_video_27560\__MACOSX\粉色浪漫婚礼 folder-1\
 J:\机械D\JisuCloud\摄图网_video_27560\__MACOSX\粉色浪漫婚礼 folder-1;J:\机械D\JisuCloud\摄图网_video_27560\__MACOSX\粉色浪漫婚礼 folder-1\(Footage);J:\机械D\JisuCloud\摄图网_video_27560\__MACOSX\粉色浪漫婚礼 folder-1
 J:\机械G\尘封的回忆\单反\100ND780;J:\机械G\尘封的回忆\单反\100ND780\姐-婚礼;J:\机械G\尘封的回忆\单反\100ND780'''
 
-    csv_file_path = "处理总文件md5.csv"  # 输入的 CSV 文件路径
+    db_path = catalog_path("处理总文件")  # 输入的目录库路径
     unique_files_output_csv = "unique_files.csv"  # 输出的独有文件 CSV
     same_files_output_csv = "same_files.csv"  # 输出的独有文件 CSV
-    num_threads = 2048
+    plan_output_csv = "deletion_plan.csv"  # 输出的删除计划 CSV
+    conflicts_output_csv = "deletion_conflicts.csv"  # 输出的删除冲突 CSV
+    workers_per_device = DEFAULT_WORKERS_PER_DEVICE  # 每个设备同时进行的回收站操作数
+    dry_run = False  # 为 True 时只输出删除计划，不删除文件
     if dir.__contains__("\n"):
-        start_with_str(csv_file_path, unique_files_output_csv, same_files_output_csv, dir, num_threads)
+        start_with_str(db_path, unique_files_output_csv, same_files_output_csv, plan_output_csv,
+                       conflicts_output_csv, dir, workers_per_device, dry_run)
     else:
-        start_with_input(csv_file_path, unique_files_output_csv, same_files_output_csv, dir, num_threads)
\ No newline at end of file
+        start_with_input(db_path, unique_files_output_csv, same_files_output_csv, plan_output_csv,
+                         conflicts_output_csv, dir, workers_per_device, dry_run)
\ No newline at end of file
@@ -0,0 +1,44 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import Catalog, catalog_path
+from common.dedup import find_duplicates, group_by_md5
+from common.pipeline import walk_files
+
+def collect_files(folder_paths):
+    """
+    遍历多个文件夹，收集文件路径及大小、修改时间等属性（按大小分组需要完整列表）
+    """
+    return list(walk_files(folder_paths))
+
+def save_to_catalog(entries, md5_map, db_path, algorithm="md5"):
+    """
+    将查重结果写入目录库：计算出 MD5 的文件写入 MD5，其余文件只写入属性。
+    之后可直接运行 1_2_按md5统计.py 输出按 MD5 分组的结果。
+    """
+    with Catalog(db_path) as catalog:
+        catalog.upsert_md5(((md5_map[path], name, root, path, 0, *stat)
+                            for name, root, path, stat in entries if path in md5_map), hash_algo=algorithm)
+        catalog.upsert_stat((name, root, path, *stat)
+                            for name, root, path, stat in entries if path not in md5_map)
+
+if __name__ == "__main__":
+    num_threads = 64
+    algorithm = "md5"  # 摘要算法，可选 md5、blake2b、xxhash、blake3（后两种需安装对应模块）
+    input_folders = r"I:\BaiduNetdiskDownload;J:\机械D;J:\机械F;J:\机械G"
+    output_db = catalog_path("处理总文件")  # 输出目录库
+
+    start_time = time.time()
+    entries = collect_files(input_folders)
+    print(f"共找到 {len(entries)} 个文件，开始分级查重...")
+    md5_map, stats = find_duplicates(entries, num_threads=num_threads, algorithm=algorithm)
+    save_to_catalog(entries, md5_map, output_db, algorithm=algorithm)
+
+    groups = group_by_md5(md5_map)
+    print(f"大小相同的文件数：{stats['大小相同的文件数']}，头尾相同的文件数：{stats['头尾相同的文件数']}")
+    print(f"重复文件组数：{len(groups)}，重复文件数：{sum(len(paths) for paths in groups.values())}")
+    print(f"总字节数：{stats['总字节数']}，实际读取字节数：{stats['读取字节数']}")
+    print(f"处理完成，结果已保存到 {output_db}")
+    print(f"查重耗时： {time.time() - start_time} 秒")
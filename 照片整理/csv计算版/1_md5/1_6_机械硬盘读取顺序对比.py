@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.disk_order import fiemap_offset, iter_physical_order
+from common.hashing import calculate_digest
+from common.pipeline import run_pipeline, walk_files
+
+def drop_file_cache(entries):
+    """
+    尽量把文件从系统缓存中移除，保证每种读取方式都从磁盘读取（需要 posix_fadvise，Windows 不支持）
+    :return: 是否成功移除
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for _, _, file_path, _ in entries:
+        try:
+            fd = os.open(file_path, os.O_RDONLY)
+            try:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+    return True
+
+def hash_thread_pool(entries, num_threads, algorithm):
+    """
+    原来的方式：按遍历顺序提交到线程池，按完成顺序取结果
+    """
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        futures = [executor.submit(calculate_digest, entry[2], algorithm) for entry in entries]
+        for future in tqdm(as_completed(futures), total=len(futures), desc=f"线程池({num_threads}线程)", unit="文件"):
+            future.result()
+
+def hash_physical_order(entries, num_readers, algorithm):
+    """
+    机械硬盘模式：按物理位置排序后由少量线程顺序读取
+    """
+    tasks = iter_physical_order(entries, lambda entry: entry[2], lambda entry: entry[3][2])
+    results = run_pipeline(tasks, lambda entry: calculate_digest(entry[2], algorithm), num_workers=num_readers)
+    for _ in tqdm(results, total=len(entries), desc=f"物理顺序({num_readers}线程)", unit="文件"):
+        pass
+
+def benchmark(folder_paths, num_threads=64, num_readers=1, algorithm="md5"):
+    """
+    对比线程池顺序与物理顺序读取同一批文件的耗时和吞吐量
+    """
+    entries = list(walk_files(folder_paths))
+    total_bytes = sum(entry[3][0] for entry in entries)
+    if not entries:
+        print("没有找到文件，程序退出。")
+        return
+    print(f"共 {len(entries)} 个文件，{total_bytes / 1024 / 1024:.1f} MB")
+    print("排序方式: " + ("FIEMAP 物理偏移" if fiemap_offset(entries[0][2]) is not None else "inode"))
+
+    results = {}
+    for name, run in (("线程池", lambda: hash_thread_pool(entries, num_threads, algorithm)),
+                      ("物理顺序", lambda: hash_physical_order(entries, num_readers, algorithm))):
+        if not drop_file_cache(entries):
+            print("当前系统无法清除文件缓存，第二次读取可能命中缓存，建议每种方式重启后分别测试")
+        start_time = time.time()
+        run()
+        results[name] = time.time() - start_time
+
+    for name, elapsed_time in results.items():
+        print(f"{name}: 耗时 {elapsed_time:.2f} 秒，吞吐量 {total_bytes / 1024 / 1024 / max(elapsed_time, 1e-9):.1f} MB/s")
+
+if __name__ == "__main__":
+    folder_paths = r"J:\机械D"  # 机械硬盘上的测试目录，多个目录用分号分隔
+    num_threads = 64  # 线程池方式的线程数
+    num_readers = 1  # 物理顺序方式的读取线程数
+    benchmark(folder_paths, num_threads=num_threads, num_readers=num_readers)
@@ -1,164 +1,148 @@
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
-import csv
-from PIL import Image
-import imagehash
+import sys
+from functools import partial
 from tqdm import tqdm
-from PIL import ImageFile
-
-# 提高 Pillow 的像素限制
-Image.MAX_IMAGE_PIXELS = None  # 或者设置为一个更大的值
-ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 import imghdr
-from PIL import Image
-import imagehash
 
-def is_image_file(file_path):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import Catalog, catalog_path
+from common.clustering import update_clusters_incrementally
+from common.disk_order import iter_physical_order
+from common.image_hash import compute_hashes, hash_chunk, int_to_hex
+from common.pipeline import run_pipeline, run_process_pipeline, walk_files
+from common.scheduler import group_folders_by_device, run_device_pipeline
+
+def read_image_bytes(file_path):
     """
-    判断文件是否为图片
-    :param file_path: 文件路径
-    :return: 如果是图片返回 True，否则返回 False
+    机械硬盘模式的读取线程：整体读取图片文件内容，非图片只读取文件头
+    :return: (文件路径, 文件内容)，不是图片或读取失败时返回 None
     """
     try:
-        return imghdr.what(file_path) is not None
-    except Exception as e:
-        print(f"无法判断文件类型: {file_path}, 错误: {e}")
-        return False
+        with open(file_path, "rb") as f:
+            header = f.read(32)
+            if imghdr.what(None, h=header) is None:
+                print(f"文件 {file_path} 不是图片，跳过处理")
+                return None
+            return file_path, header + f.read()
+    except OSError as e:
+        print(f"无法读取文件 {file_path}，错误: {e}")
+        return None
+
 
-def calculate_image_hash(image_path, hash_method):
+def build_row(file_path, hash_values):
     """
-    计算图片的感知哈希值。
-    :param image_path: 图片路径
-    :param hash_method: 哈希方法（phash、average_hash、dhash）
-    :return: 图片哈希值（str），如果无法计算返回 None
+    把哈希整数转换为写入目录库的行
+    :param hash_values: {哈希方法: 哈希整数或 None}
+    :return: 包含文件信息和所有哈希值的字典，没有任何哈希值时返回 None
     """
-    if not is_image_file(image_path):
-        print(f"文件 {image_path} 不是图片，跳过处理")
+    hash_values = {method: int_to_hex(value) for method, value in hash_values.items() if value is not None}
+    if not hash_values:
         return None
+    return {
+        "文件名": os.path.basename(file_path),
+        "文件目录": os.path.dirname(file_path),
+        "文件路径": file_path,
+        "是否删除": "0",  # 默认未删除
+        **hash_values  # 展开哈希值
+    }
 
-    try:
-        with Image.open(image_path) as img:
-            if hash_method == "phash":
-                return str(imagehash.phash(img))
-            elif hash_method == "average_hash":
-                return str(imagehash.average_hash(img))
-            elif hash_method == "dhash":
-                return str(imagehash.dhash(img))
-            else:
-                print(f"未知的哈希方法: {hash_method}")
-                return None
-    except Exception as e:
-        print(f"文件 {image_path} 获取 imagehash 异常: {e}")
-        return None
 
-
-def process_file(file_path, hash_methods):
+def process_file(file_path, hash_methods, data=None):
     """
     处理单个文件，计算多种哈希值并返回结果。
     :param file_path: 文件路径
     :param hash_methods: 哈希方法列表（如 ['phash', 'average_hash', 'dhash']）
+    :param data: 已读入内存的文件内容，为空时从文件读取
     :return: 包含文件信息和所有哈希值的字典，如果不是图片返回 None
     """
-    file_name = os.path.basename(file_path)
-    file_dir = os.path.dirname(file_path)
-    hash_values = {}
-
-    for hash_method in hash_methods:
-        hash_value = calculate_image_hash(file_path, hash_method)
-        if hash_value:
-            hash_values[hash_method] = hash_value
-
-    if hash_values:  # 至少成功计算一种哈希值
-        return {
-            "文件名": file_name,
-            "文件目录": file_dir,
-            "文件路径": file_path,
-            "是否删除": "0",  # 默认未删除
-            **hash_values  # 展开哈希值
-        }
-    else:
-        # print(f"{file_name}不是图片")
-        return None
+    return build_row(file_path, compute_hashes(file_path, hash_methods, data))
 
 
-def process_directories(directories, output_csv_prefix, hash_methods, max_threads=4):
+def iter_file_paths(directories, counter):
     """
-    遍历给定目录，计算所有图片的哈希值，并保存到多个 CSV 文件。
-    :param directories: 多个目录路径，用分号连接
-    :param output_csv_prefix: 输出 CSV 文件前缀
-    :param hash_methods: 哈希方法列表（如 ['phash', 'average_hash', 'dhash']）
-    :param max_threads: 最大线程数
+    生产者：逐个目录遍历，产出文件路径，并统计扫描的文件数
     """
-    # 准备存储结果的列表
-    results = []
-    all_files = 0
-    all_image_files = 0
-    file_paths = []
-
-    # 遍历所有目录
-    for directory in directories.split(";"):
-        directory = directory.strip()  # 去掉前后空格
-        if not os.path.exists(directory):
-            print(f"目录不存在：{directory}")
-            continue
-
-        # 收集所有文件路径
-        for root, _, files in os.walk(directory):
-            for file in files:
-                all_files += 1
-                file_paths.append(os.path.join(root, file))
-
-    print(f"总共扫描{all_files}个文件，开始计算 imagehash...")
-    # 使用多线程处理文件
-    with ThreadPoolExecutor(max_threads) as executor:
-        future_to_file = {executor.submit(process_file, file_path, hash_methods): file_path for file_path in file_paths}
-        for future in tqdm(as_completed(future_to_file), total=len(future_to_file), desc="计算 ImageHash", unit="文件"):
-            try:
-                result = future.result()
-                if result:
-                    all_image_files += 1
-                    results.append(result)
-            except Exception as e:
-                print(f"处理文件时出错：{e}")
+    for file_name, root, file_path, _ in walk_files(directories, with_stat=False):
+        counter["all_files"] += 1
+        yield file_path
 
-    print(f"总共扫描{all_files}个文件，成功处理{all_image_files}个图片")
-    print("============================================================================================================")
 
-    # 为每种哈希方法分别写入结果到 CSV 文件
-    for hash_method in hash_methods:
-        output_csv = f"{output_csv_prefix}_{hash_method}.csv"
-        with open(output_csv, mode="w", newline="", encoding="utf-8") as file:
-            fieldnames = ["imagehash", "文件名", "文件目录", "文件路径", "是否删除"]
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
+def process_directories(directories, db_path, hash_methods, max_threads=4, queue_size=1024,
+                        hdd_mode=False, hdd_readers=1, hdd_buffer=32,
+                        use_processes=False, num_processes=None, chunk_size=8):
+    """
+    遍历给定目录，计算所有图片的哈希值，并保存到目录库。
+    遍历、计算、写入组成流水线：目录按所在设备分组，每个设备的遍历线程把文件放入有界队列，
+    该设备的计算线程取出计算，线程数按实测吞吐量自动调整；当前线程按完成顺序分批写入目录库，
+    内存占用与文件总数无关。
+    :param directories: 多个目录路径，用分号连接
+    :param db_path: 输出目录库路径
+    :param hash_methods: 哈希方法列表（如 ['phash', 'average_hash', 'dhash']）
+    :param max_threads: 每个设备的最大线程数
+    :param queue_size: 队列最大长度
+    :param hdd_mode: 机械硬盘模式：文件按物理位置（FIEMAP 或 inode）排序，每个设备由 hdd_readers 个线程
+                     顺序读入内存，再由 max_threads 个线程解码计算，读取和计算互不阻塞
+    :param hdd_readers: 机械硬盘模式下每个设备的读取线程数
+    :param hdd_buffer: 机械硬盘模式下已读入内存、等待计算的最大文件数
+    :param use_processes: 多进程模式：解码和计算哈希受 GIL 限制，改为由 num_processes 个进程计算，
+                          任务按 chunk_size 个文件一批提交，进程只返回打包为 64 位整数的哈希值。
+                          各设备的遍历线程并行产出文件路径，进程自行读取文件，文件内容不经过进程间传输；
+                          机械硬盘模式下仍由各设备的读取线程按物理顺序读入内存，再按批交给进程
+    :param num_processes: 多进程模式下的进程数，默认为 CPU 核数
+    :param chunk_size: 多进程模式下每批的文件数
+    """
+    device_groups = group_folders_by_device(directories)
+    counters = {device: {"all_files": 0} for device in device_groups}
+    print("开始扫描文件并计算 imagehash...")
+    sources = {device: iter_file_paths(folders, counters[device]) for device, folders in device_groups.items()}
+    if hdd_mode:
+        sources = {device: iter_physical_order(file_paths, lambda file_path: file_path)
+                   for device, file_paths in sources.items()}
+        contents = run_device_pipeline(sources, read_image_bytes, initial_workers=hdd_readers,
+                                       min_workers=hdd_readers, max_workers=hdd_readers, queue_size=hdd_buffer)
+    elif use_processes:
+        # 各设备的遍历线程并行产出路径，由进程读取文件，不同设备的文件同时读取
+        contents = run_device_pipeline(sources, lambda file_path: (file_path, None),
+                                       initial_workers=1, min_workers=1, max_workers=1, queue_size=queue_size)
+    if use_processes:
+        # 按批提交，每批一次进程间传输；在途的批数默认为进程数的 2 倍
+        packed = run_process_pipeline(contents, partial(hash_chunk, hash_methods=hash_methods),
+                                      num_workers=num_processes, chunk_size=chunk_size)
+        results = (build_row(file_path, dict(zip(hash_methods, values))) for file_path, values in packed)
+    elif hdd_mode:
+        results = run_pipeline(contents, lambda content: process_file(content[0], hash_methods, content[1]),
+                               num_workers=max_threads, queue_size=hdd_buffer)
+    else:
+        results = run_device_pipeline(sources, lambda file_path: process_file(file_path, hash_methods),
+                                      max_workers=max_threads, queue_size=queue_size)
 
-            # 写入表头
-            writer.writeheader()
+    # 边计算边写入目录库中的对应列
+    with Catalog(db_path) as catalog:
+        all_image_files = catalog.upsert_image_rows(tqdm(results, desc="计算 ImageHash", unit="文件"))
 
-            # 写入每行数据
-            for row in results:
-                if hash_method in row:  # 仅写入当前哈希方法的值
-                    writer.writerow({
-                        "imagehash": row[hash_method],
-                        "文件名": row["文件名"],
-                        "文件目录": row["文件目录"],
-                        "文件路径": row["文件路径"],
-                        "是否删除": row["是否删除"]
-                    })
+    all_files = sum(counter["all_files"] for counter in counters.values())
+    print(f"总共扫描{all_files}个文件，成功处理{all_image_files}个图片")
+    print(f"结果已保存到 {db_path}")
 
-        print(f"结果已保存到 {output_csv}")
+    # 已做过完整聚类时，只为新增或变化的图片归组
+    update_clusters_incrementally(db_path, hash_methods)
+    print("============================================================================================================")
 
 
 if __name__ == '__main__':
-    max_threads = 128  # 指定线程数
+    max_threads = 128  # 每个设备的最大线程数，实际线程数按吞吐量自动调整
     hash_methods = ["phash", "average_hash", "dhash"]  # 多种哈希方法。dhash最严格
+    hdd_mode = True  # 处理文件（J:\机械*）在机械硬盘上，按物理顺序读取
+    use_processes = True  # 多进程计算哈希，充分利用多核
 
 
     # 原始文件
     start_time = time.time()
     directories = r"D:\JisuCloud;D:\BaiduNetdiskDownload\pc08803;D:\BaiduNetdiskDownload\PS;D:\BaiduNetdiskDownload\相册·2;D:\桌面;F:\FileRecv;G:\尘封的回忆;K:\BaiduNetdiskDownload"  # 多个目录，用分号分隔
-    process_directories(directories, "原始总文件image", hash_methods, max_threads)
+    process_directories(directories, catalog_path("原始总文件"), hash_methods, max_threads,
+                        use_processes=use_processes)
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"原始文件处理耗时： {elapsed_time} 秒")
@@ -166,7 +150,8 @@ if __name__ == '__main__':
     # 处理文件
     start_time = time.time()
     directories = r"I:\BaiduNetdiskDownload;J:\机械D;J:\机械F;J:\机械G"  # 多个目录，用分号分隔
-    process_directories(directories, "处理总文件image", hash_methods, max_threads)
+    process_directories(directories, catalog_path("处理总文件"), hash_methods, max_threads, hdd_mode=hdd_mode,
+                        use_processes=use_processes)
     end_time = time.time()
     elapsed_time = end_time - start_time
     print(f"处理文件处理耗时： {elapsed_time} 秒")
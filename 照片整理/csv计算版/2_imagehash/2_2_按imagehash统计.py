@@ -1,90 +1,148 @@
-import csv
+import os
+import sys
 
+import numpy as np
 
-def hamming_distance(hash1, hash2):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import Catalog, catalog_path
+from common.clustering import (cluster_index, compute_edges, edges_path, groups_from_edges, load_edges,
+                               save_cluster_groups, save_edges, threshold_summary, write_groups_csv)
+from common.hash_index import index_path, load_index
+from common.hash_store import HashStore
+
+
+def process_imagehash(db_path, hash_method, output_csv, threshold, num_workers=None):
     """
-    计算两个哈希值的汉明距离。
-    :param hash1: 哈希值1（字符串）
-    :param hash2: 哈希值2（字符串）
-    :return: 汉明距离（整数）
+    统计所有文件及相似文件组，输出到指定的 CSV 文件，字段按升序排序。
+    汉明距离不超过阈值的图片归为一组（连通分组，结果与读取顺序无关），
+    近邻查找在多个进程中按分区进行，合并使用并查集。
+    :param db_path: 输入目录库
+    :param hash_method: 哈希方法（phash、average_hash、dhash）
+    :param output_csv: 输出文件
+    :param threshold: 哈希相似度阈值
+    :param num_workers: 进程数，默认为 CPU 核数
     """
-    # return sum(c1 != c2 for c1, c2 in zip(hash1, hash2))
+    store = load_store_and_index(db_path, hash_method)
+    if not len(store):
+        print(f"目录库中没有 {hash_method} 哈希值")
+        return
 
-    # 将十六进制字符串转换为整数
-    hash1_int = int(hash1, 16)
-    hash2_int = int(hash2, 16)
+    groups = cluster_index(index_path(db_path, hash_method), len(store), threshold, num_workers=num_workers)
+    write_groups_csv([[store.rows[i] for i in members] for members in groups], output_csv)
+    # 保存聚类编号，之后 2_1 新增的图片可以增量归组
+    save_cluster_groups(db_path, hash_method, threshold, store.ids, groups)
 
-    # 计算两个整数之间的差异
-    return abs(hash1_int - hash2_int)
+    print(f"处理完成，结果已保存到 {output_csv}")
 
 
-def process_imagehash(input_csv, output_csv, threshold):
+def load_store_and_index(db_path, hash_method):
     """
-    统计所有文件及相似文件组，输出到指定的 CSV 文件，字段按升序排序。
-    :param input_csv: 输入文件（总文件imagehash.csv）
-    :param output_csv: 输出文件
-    :param threshold: 哈希相似度阈值
+    读取目录库中未删除的文件（哈希按位打包为 uint64 数组），并保证磁盘上的近邻索引与之一致，
+    供各进程从索引文件加载。索引按读取时该哈希的修改代数判断是否需要重建。
+    """
+    store = HashStore.from_catalog(db_path, hash_method)
+    if len(store):
+        load_index(db_path, hash_method, store=store)
+    return store
+
+
+def compute_similarity_edges(db_path, hash_method, max_threshold, num_workers=None):
     """
-    # 读取输入文件并筛选未删除的文件
-    files = []
-    with open(input_csv, mode="r", encoding="utf-8") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row["是否删除"] == "0":  # 仅处理未删除的文件
-                files.append(row)
-
-    # 按 imagehash 分组，并允许根据阈值计算相似组
-    groups = []
-    for file1 in files:
-        matched = False
-        for group in groups:
-            # 如果文件哈希与组内任一文件相似，归入该组
-            if any(hamming_distance(file1["imagehash"], f["imagehash"]) <= threshold for f in group):
-                group.append(file1)
-                matched = True
-                break
-        if not matched:
-            groups.append([file1])
-
-    # 准备输出数据
-    output_data = []
-    for group in groups:
-        row = {"文件数": len(group)}
-        for i, file in enumerate(group):
-            row[f"文件名{i+1}"] = file["文件名"]
-            row[f"文件目录{i+1}"] = file["文件目录"]
-            row[f"文件路径{i+1}"] = file["文件路径"]
-        output_data.append(row)
-
-    # 确定所有字段名并排序
-    max_files = max(len(group) for group in groups)
-    fieldnames = ["文件数"]
-    for i in range(1, max_files + 1):
-        fieldnames.extend([f"文件名{i}", f"文件目录{i}", f"文件路径{i}"])
-    fieldnames = sorted(fieldnames)  # 按升序排序字段名
-
-    # 写入输出文件
-    with open(output_csv, mode="w", newline="", encoding="utf-8") as file:
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-
-        writer.writeheader()
-        for row in output_data:
-            # 对 row 的键进行排序
-            sorted_row = {key: row.get(key, "") for key in fieldnames}
-            writer.writerow(sorted_row)
+    阈值扫描模式：一次计算汉明距离不超过 max_threshold 的所有相似边并保存到边文件，
+    该哈希未修改且已保存的最大阈值足够时直接读取边文件。
+    :return: (文件信息, 相似边)
+    """
+    store = load_store_and_index(db_path, hash_method)
+    generation = store.generation
+    path = edges_path(db_path, hash_method)
+
+    if os.path.exists(path):
+        edges = load_edges(path)
+        if (edges["generation"] == generation and edges["max_distance"] >= max_threshold
+                and np.array_equal(edges["ids"], store.ids)):
+            print(f"已加载 {hash_method} 相似边: {path}")
+            return store, edges
+
+    lefts, rights, distances = compute_edges(index_path(db_path, hash_method), len(store), max_threshold,
+                                             num_workers=num_workers)
+    save_edges(path, lefts, rights, distances, store.ids, max_threshold, generation)
+    print(f"{hash_method} 共 {len(distances)} 条相似边，已保存到 {path}")
+    return store, load_edges(path)
 
+
+def print_threshold_summary(store, edges, hash_method, max_threshold):
+    """
+    打印每个阈值下的相似组数、相似组中的文件数和最大组文件数
+    """
+    summary = threshold_summary(len(store), edges["lefts"], edges["rights"], edges["distances"], max_threshold)
+    print(f"{hash_method}（共 {len(store)} 个图片）")
+    print(f"{'阈值':>4}{'相似组数':>10}{'相似组中的文件数':>14}{'最大组文件数':>10}")
+    for row in summary:
+        print(f"{row['阈值']:>6}{row['相似组数']:>14}{row['相似组中的文件数']:>22}{row['最大组文件数']:>16}")
+    return summary
+
+
+def write_threshold_groups(store, edges, threshold, output_csv, db_path=None, hash_method=None):
+    """
+    从相似边直接得到指定阈值下的分组并写出，无需重新查找。
+    提供 db_path 和 hash_method 时同时保存聚类编号，供增量聚类使用。
+    """
+    groups = groups_from_edges(len(store), edges["lefts"], edges["rights"], edges["distances"], threshold)
+    write_groups_csv([[store.rows[i] for i in members] for members in groups], output_csv)
+    if db_path and hash_method:
+        save_cluster_groups(db_path, hash_method, threshold, store.ids, groups)
     print(f"处理完成，结果已保存到 {output_csv}")
 
 
+def export_clusters(db_path, hash_method, output_csv):
+    """
+    按目录库中保存的聚类编号（完整聚类加之后的增量聚类）直接写出分组，无需重新聚类。
+    """
+    with Catalog(db_path) as catalog:
+        threshold = catalog.cluster_threshold(hash_method)
+        if threshold is None:
+            print(f"{hash_method} 尚未聚类，请先运行完整聚类")
+            return
+        clusters = dict(catalog.iter_cluster_items(hash_method))
+        groups = {}
+        for file_id, row in catalog.iter_imagehash_items(hash_method):
+            # 尚未归组的文件单独成组
+            groups.setdefault(clusters.get(file_id) or -file_id, []).append(row)
+    write_groups_csv(list(groups.values()), output_csv)
+    print(f"{hash_method} 聚类（阈值 {threshold}）已保存到 {output_csv}")
+
+
 if __name__ == '__main__':
-    # 输入文件路径。dhash最严格
-    input_csvs = "处理总文件image_dhash.csv;处理总文件image_average_hash.csv;处理总文件image_phash.csv"  # 输入文件
-    # 用户输入阈值
-    threshold = int(input("请输入哈希阈值："))
-    for input_csv in input_csvs.split(";"):
-        hash_method = input_csv.replace(".csv", "").replace("处理总文件image_", "")
-        # 输出文件路径
-        output_csv = f"按_{hash_method}_统计_{threshold}.csv"
-
-        # 调用函数处理
-        process_imagehash(input_csv, output_csv, threshold)
+    # 输入目录库。dhash最严格
+    db_path = catalog_path("处理总文件")
+    hash_methods = ["dhash", "average_hash", "phash"]
+    # 阈值扫描模式：先计算最大阈值内的所有相似边并打印各阈值的分组统计，之后任意阈值都直接从边文件分组
+    sweep = True
+    max_threshold = 12
+
+    if sweep:
+        results = {}
+        for hash_method in hash_methods:
+            store, edges = compute_similarity_edges(db_path, hash_method, max_threshold)
+            if len(store):
+                print_threshold_summary(store, edges, hash_method, max_threshold)
+                results[hash_method] = (store, edges)
+
+        # 用户输入阈值，可以输入多个
+        thresholds = input(f"请输入哈希阈值（不超过 {max_threshold}，多个用逗号分隔）：")
+        for threshold in [int(value) for value in thresholds.split(",") if value.strip()]:
+            if threshold > max_threshold:
+                print(f"阈值 {threshold} 超过最大阈值 {max_threshold}，跳过")
+                continue
+            for hash_method, (store, edges) in results.items():
+                write_threshold_groups(store, edges, threshold, f"按_{hash_method}_统计_{threshold}.csv",
+                                       db_path, hash_method)
+    else:
+        # 用户输入阈值
+        threshold = int(input("请输入哈希阈值："))
+        for hash_method in hash_methods:
+            # 输出文件路径
+            output_csv = f"按_{hash_method}_统计_{threshold}.csv"
+
+            # 调用函数处理
+            process_imagehash(db_path, hash_method, output_csv, threshold)
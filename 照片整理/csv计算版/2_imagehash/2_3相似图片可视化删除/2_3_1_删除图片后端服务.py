@@ -1,32 +1,52 @@
-from flask import Flask, request, jsonify, send_file
-from send2trash import send2trash
+from flask import Blueprint, Flask, request, jsonify, send_file
 from flask_cors import CORS
+import io
 import os
-import hashlib
-from PIL import Image
+import sys
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-app = Flask(__name__)
-CORS(app)  # 允许跨域请求
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from common.catalog import Catalog, catalog_path
+from common.thumbnail import (THUMBNAIL_SIZE, ThumbnailCache, clamp_size, image_dimensions, prewarm_thumbnails,
+                              read_group_paths)
+from common.trash import trash_files
 
-# 禁用 Flask 默认日志
-log = logging.getLogger('werkzeug')
-log.setLevel(logging.ERROR)
+# 接口在 create_app() 中注册。预生成缩略图的进程池在 Windows 上以 spawn 方式启动，子进程会重新导入本模块，
+# 因此导入时不创建 Flask 应用和缩略图缓存，子进程只需要 common.thumbnail 中的 render_chunk
+routes = Blueprint('routes', __name__)
 
 # 临时文件存储路径
 TEMP_IMAGE_PATH = "./temp_images"
 
-# 创建临时文件夹
-os.makedirs(TEMP_IMAGE_PATH, exist_ok=True)
+# 缩略图缓存：磁盘上限 2GB，内存中保留最近使用的 64MB，第一次使用时创建（需要扫描缓存目录）
+thumbnail_cache = None
+thumbnail_cache_lock = threading.Lock()
 
+# 转换缩略图时请求最多等待的秒数，普通图片在这段时间内即可返回，RAW 等慢的转换先返回 pending
+CONVERT_WAIT_SECONDS = 0.5
 
-def calculate_md5(file_path):
-    """计算文件路径的 MD5 值"""
-    md5_hash = hashlib.md5(file_path.encode()).hexdigest()
-    return md5_hash
+# 共享目录库
+DB_PATH = catalog_path("处理总文件")
 
+# 批量读取文件信息的线程数
+METADATA_WORKERS = 8
 
-@app.route('/file-size', methods=['GET'])
+# 缩略图预生成任务的进度，同一时间只运行一个任务
+prewarm_lock = threading.Lock()
+prewarm_progress = {'status': 'idle'}
+
+
+def get_thumbnail_cache():
+    global thumbnail_cache
+    with thumbnail_cache_lock:
+        if thumbnail_cache is None:
+            thumbnail_cache = ThumbnailCache(TEMP_IMAGE_PATH)
+        return thumbnail_cache
+
+
+@routes.route('/file-size', methods=['GET'])
 def file_size():
     file_path = request.args.get('filePath')
     try:
@@ -41,7 +61,7 @@ def file_size():
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/convert-image', methods=['GET'])
+@routes.route('/convert-image', methods=['GET'])
 def convert_image():
     file_path = request.args.get('filePath')
     try:
@@ -51,103 +71,172 @@ def convert_image():
             print(f"{file_path} 文件不存在")
             return send_file(r"F:\Warehouse\Epiboly\Pic_Deal_Python\照片整理\csv计算版\2_imagehash\2_3相似图片可视化删除\不存在.jpg", mimetype='image/jpeg')
 
-        pic_formats = ['.jpg', '.jpeg', '.png', '.gif', '.bmp']
-        for pic_format in pic_formats:
-            if file_path.lower().endswith(pic_format):
-                # 根据文件扩展名设置正确的 MIME 类型
-                if pic_format == '.jpg' or pic_format == '.jpeg':
-                    mimetype = 'image/jpeg'
-                elif pic_format == '.png':
-                    mimetype = 'image/png'
-                elif pic_format == '.gif':
-                    mimetype = 'image/gif'
-                elif pic_format == '.bmp':
-                    mimetype = 'image/bmp'
-                return send_file(file_path, mimetype=mimetype)
-
-
-        # 生成缩略图文件名
-        file_name = os.path.basename(file_path)
-        md5_hash = calculate_md5(file_path)
-        thumbnail_name = f"thumbnail_{file_name}_{md5_hash}.jpg"
-        thumbnail_path = os.path.join(TEMP_IMAGE_PATH, thumbnail_name)
-
-        # 如果缩略图已存在，则直接返回
-        if os.path.exists(thumbnail_path):
-            # print(f"{thumbnail_path} 缩略图已存在")
-            return send_file(thumbnail_path, mimetype='image/jpeg')
-
-        convert_raw_to_jpg(file_path, thumbnail_path)
-
-        # print(f"{thumbnail_path} 成功生成缩略图")
-
-        # 返回缩略图文件
-        return send_file(thumbnail_path, mimetype='image/jpeg')
+        # 所有格式都返回缩略图，size 为最长边像素数，默认按页面图片宽度的 2 倍
+        size = clamp_size(request.args.get('size', THUMBNAIL_SIZE, type=int))
+        data = get_thumbnail_cache().request(file_path, size, timeout=CONVERT_WAIT_SECONDS)
+        if data is None:
+            # 转换仍在进行，前端稍后重新请求
+            return jsonify({'status': 'pending'}), 202
+        return send_file(io.BytesIO(data), mimetype='image/jpeg')
     except Exception as e:
         print(f"接口异常：", e)
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/check-file-existence', methods=['GET'])
+@routes.route('/check-file-existence', methods=['GET'])
 def check_file_existence():
     file_path = request.args.get('filePath')
     exists = os.path.exists(file_path)
     return jsonify({'exists': exists}), 200
 
 
-@app.route('/delete', methods=['POST'])
-def delete_file():
+def run_prewarm(csv_path, size):
+    try:
+        prewarm_thumbnails(get_thumbnail_cache(), read_group_paths(csv_path), size, progress=prewarm_progress)
+        prewarm_progress['status'] = 'complete'
+        print(f"缩略图预生成完成: {csv_path}")
+    except Exception as e:
+        print("缩略图预生成异常", e)
+        prewarm_progress['status'] = 'error'
+        prewarm_progress['error'] = str(e)
+    finally:
+        prewarm_lock.release()
+
+
+@routes.route('/prewarm', methods=['POST'])
+def prewarm():
+    """
+    读取分组 CSV（2_2 的分组结果或 1_3 的 same_files），在后台按审阅顺序用多进程预生成所有缩略图
+    """
     data = request.json
-    file_path = data.get('filePath')
+    csv_path = data.get('csvPath')
+    size = clamp_size(data.get('size', THUMBNAIL_SIZE))
+    if not csv_path or not os.path.exists(csv_path):
+        return jsonify({'error': f'CSV 文件不存在: {csv_path}'}), 400
+    if not prewarm_lock.acquire(blocking=False):
+        return jsonify({'error': '已有缩略图预生成任务在运行'}), 409
+    prewarm_progress.clear()
+    prewarm_progress.update({'status': 'running', 'csvPath': csv_path, 'size': size})
+    threading.Thread(target=run_prewarm, args=(csv_path, size), daemon=True).start()
+    return jsonify({'message': '缩略图预生成已开始'}), 200
+
+
+@routes.route('/prewarm-progress', methods=['GET'])
+def prewarm_status():
+    """
+    返回缩略图预生成任务的进度
+    """
+    progress = dict(prewarm_progress)
+    return jsonify({
+        'status': progress.get('status'),
+        'csvPath': progress.get('csvPath'),
+        'size': progress.get('size'),
+        'total': progress.get('总数', 0),
+        'done': progress.get('已完成', 0),
+        'rendered': progress.get('已生成', 0),
+        'cached': progress.get('已缓存', 0),
+        'missing': progress.get('不存在', 0),
+        'failed': progress.get('失败', 0),
+        'error': progress.get('error'),
+    }), 200
+
+
+def stats_to_json(stats):
+    """把目录统计转换为接口返回的字段"""
+    return {
+        'directory': stats['目录'],
+        'fileCount': stats['文件数'],
+        'bytes': stats['文件大小'],
+        'duplicateFiles': stats['重复文件数'],
+        'duplicateBytes': stats['重复文件大小'],
+        'duplicateShare': stats['重复文件占比'],
+    }
+
+
+@routes.route('/directory-stats', methods=['GET'])
+def directory_stats():
+    """
+    返回目录（含子目录）的统计和各子目录的统计，子目录按可释放空间（重复文件大小）降序排列。
+    不传 directory 时返回各根目录。
+    """
+    directory = request.args.get('directory') or None
+    limit = request.args.get('limit', type=int)
     try:
-        send2trash(file_path)
-        return jsonify({'message': '文件已移入回收站'}), 200
+        with Catalog(DB_PATH) as catalog:
+            stats = catalog.directory_stats(directory) if directory else None
+            children = catalog.child_directory_stats(directory, limit)
+        return jsonify({
+            'stats': stats_to_json(stats) if stats else None,
+            'children': [stats_to_json(child) for child in children],
+        }), 200
     except Exception as e:
+        print("目录统计获取异常", e)
         return jsonify({'error': str(e)}), 500
 
 
-import os
-import rawpy
-from PIL import Image
-
-
-def convert_raw_to_jpg(input_path, output_path):
-    # 获取文件扩展名
-    ext = os.path.splitext(input_path)[1].lower()
-
-    # 判断文件类型，选择对应的处理方式
-    if ext == '.nef':  # 处理 .NEF 文件
-        convert_nef_to_jpg(input_path, output_path)
-    elif ext == '.cr3':  # 处理 .CR3 文件
-        convert_cr3_to_jpg(input_path, output_path)
-    else:
-        raise ValueError(f"Unsupported file format: {ext}")
-
+def file_metadata(file_path):
+    """读取单个文件的信息，文件不存在时只返回 exists"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return {'exists': False}
+    dimensions = image_dimensions(file_path)
+    return {
+        'exists': True,
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'width': dimensions[0] if dimensions else None,
+        'height': dimensions[1] if dimensions else None,
+    }
+
+
+@routes.route('/metadata', methods=['POST'])
+def metadata():
+    """
+    批量返回文件信息：{'metadata': {文件路径: {'exists', 'size', 'mtime', 'width', 'height'}}}
+    """
+    file_paths = list(dict.fromkeys(request.json.get('filePaths') or []))
+    try:
+        with ThreadPoolExecutor(max_workers=METADATA_WORKERS) as executor:
+            results = executor.map(file_metadata, file_paths)
+            return jsonify({'metadata': dict(zip(file_paths, results))}), 200
+    except Exception as e:
+        print("文件信息获取异常", e)
+        return jsonify({'error': str(e)}), 500
 
-def convert_nef_to_jpg(nef_path, jpg_path):
-    # 使用 rawpy 打开 .NEF 文件
-    with rawpy.imread(nef_path) as raw:
-        # 转换为 RGB 图像
-        rgb = raw.postprocess()
 
-        # 使用 Pillow 保存为 .JPG 格式
-        image = Image.fromarray(rgb)
-        image.save(jpg_path, 'JPEG')
+@routes.route('/delete', methods=['POST'])
+def delete_file():
+    """
+    把文件移入回收站，filePaths 为文件路径列表（兼容只传一个 filePath），一次批量删除。
+    返回每个文件的结果，有文件不存在或删除失败时状态码为 500。
+    """
+    data = request.json
+    file_paths = data.get('filePaths') or [data.get('filePath')]
+    try:
+        # 移入回收站并同步更新目录库
+        deleted_paths, missing_paths, failures = trash_files(file_paths, DB_PATH)
+        status = 500 if missing_paths or failures else 200
+        return jsonify({
+            'message': f'{len(deleted_paths)} 个文件已移入回收站',
+            'deleted': deleted_paths,
+            'missing': missing_paths,
+            'failed': {path: str(error) for path, error in failures.items()},
+        }), status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
+def create_app():
+    app = Flask(__name__)
+    CORS(app)  # 允许跨域请求
+    app.register_blueprint(routes)
 
-def convert_cr3_to_jpg(cr3_path, jpg_path):
-    # 尝试使用 rawpy 处理 .CR3 文件（如果支持）
-    try:
-        with rawpy.imread(cr3_path) as raw:
-            # 转换为 RGB 图像
-            rgb = raw.postprocess()
+    # 禁用 Flask 默认日志
+    log = logging.getLogger('werkzeug')
+    log.setLevel(logging.ERROR)
+    return app
 
-            # 使用 Pillow 保存为 .JPG 格式
-            image = Image.fromarray(rgb)
-            image.save(jpg_path, 'JPEG')
-    except Exception as e:
-        raise ValueError(f"Error processing .CR3 file: {e}")
 
 if __name__ == '__main__':
-    app.run(debug=False)
+    create_app().run(debug=False)
 
@@ -1,7 +1,10 @@
-import csv
 import filetype
 import os
-from send2trash import send2trash
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.catalog import Catalog, catalog_path
+from common.trash import trash_files
 
 
 def is_image_file(file_path):
@@ -65,37 +68,35 @@ def is_xmp_file(file_path):
         return False
 
 
-def process_csv(csv_file, user_input):
+def process_csv(db_path, user_input):
     """
-    处理 CSV 文件，判断文件类型并处理未删除的文件。
-    :param csv_file: CSV 文件路径
+    处理目录库，判断文件类型并处理未删除的文件。
+    :param db_path: 目录库路径
     """
-    with open(csv_file, mode="r", encoding="utf-8") as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            if row["是否删除"] == "0":  # 只处理未删除的文件
-                file_path = row["文件路径"]
+    delete_paths = []
+    with Catalog(db_path) as catalog:
+        file_paths = list(catalog.all_paths())  # 只处理未删除的文件
 
-                if not os.path.exists(file_path):
-                    print(f"文件不存在: {file_path}")
-                    continue
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            print(f"文件不存在: {file_path}")
+            continue
 
-                # 判断文件是否为图片、视频或压缩包
-                if is_image_file(file_path) or is_video_file(file_path) or is_compressed_file(file_path) or is_xmp_file(file_path):
-                    continue
+        # 判断文件是否为图片、视频或压缩包
+        if is_image_file(file_path) or is_video_file(file_path) or is_compressed_file(file_path) or is_xmp_file(file_path):
+            continue
 
-                # 如果不是图片、视频或压缩包，则打印文件路径并询问是否删除
-                print(f"文件路径: {file_path}")
-                if user_input == "1":
-                    try:
-                        send2trash(file_path)
-                        print(f"文件 {file_path} 已移入回收站")
-                    except Exception as e:
-                        print(f"删除文件 {file_path} 时出错: {e}")
+        # 如果不是图片、视频或压缩包，则打印文件路径并询问是否删除
+        print(f"文件路径: {file_path}")
+        delete_paths.append(file_path)
 
+    if user_input == "1" and delete_paths:
+        # 按设备分批移入回收站，并更新目录库中被删除文件的标记
+        deleted_paths, _, _ = trash_files(delete_paths, db_path)
+        print(f"已将 {len(deleted_paths)} 个文件移入回收站")
 
 if __name__ == "__main__":
-    csv_file = "../1_md5/处理总文件md5.csv"  # CSV 文件路径
+    db_path = catalog_path("处理总文件")  # 目录库路径
     # 如果不是图片、视频或压缩包，则打印文件路径并询问是否删除
     user_input = input("是否删除此文件？输入1删除，其他键跳过: ")
-    process_csv(csv_file, user_input)
+    process_csv(db_path, user_input)
@@ -0,0 +1,741 @@
+import csv
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# 支持的感知哈希方法，对应数据库中的同名列
+HASH_METHODS = ("phash", "average_hash", "dhash")
+
+# 整理目录库时删除日志的默认保留天数
+DEFAULT_JOURNAL_KEEP_DAYS = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id           INTEGER PRIMARY KEY,
+    file_path    TEXT NOT NULL UNIQUE,
+    file_name    TEXT NOT NULL,
+    directory    TEXT NOT NULL,
+    md5          TEXT,
+    phash        TEXT,
+    average_hash TEXT,
+    dhash        TEXT,
+    deleted      INTEGER NOT NULL DEFAULT 0,
+    size         INTEGER,
+    mtime        INTEGER,
+    inode        INTEGER,
+    dev          INTEGER,
+    hash_algo    TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_files_md5 ON files(md5);
+CREATE INDEX IF NOT EXISTS idx_files_directory ON files(directory);
+CREATE INDEX IF NOT EXISTS idx_files_phash ON files(phash);
+CREATE INDEX IF NOT EXISTS idx_files_average_hash ON files(average_hash);
+CREATE INDEX IF NOT EXISTS idx_files_dhash ON files(dhash);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('phash_generation', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('average_hash_generation', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('dhash_generation', 0);
+CREATE TABLE IF NOT EXISTS dir_stats (
+    directory               TEXT PRIMARY KEY,
+    parent                  TEXT,
+    own_files               INTEGER NOT NULL DEFAULT 0,
+    own_bytes               INTEGER NOT NULL DEFAULT 0,
+    own_duplicate_files     INTEGER NOT NULL DEFAULT 0,
+    own_duplicate_bytes     INTEGER NOT NULL DEFAULT 0,
+    files                   INTEGER NOT NULL DEFAULT 0,
+    bytes                   INTEGER NOT NULL DEFAULT 0,
+    duplicate_files         INTEGER NOT NULL DEFAULT 0,
+    duplicate_bytes         INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_dir_stats_parent ON dir_stats(parent);
+CREATE TABLE IF NOT EXISTS dirty_dirs (
+    directory TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS dirty_md5s (
+    md5 TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS deletion_journal (
+    id        INTEGER PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    deleted   INTEGER NOT NULL,
+    time      INTEGER NOT NULL
+);
+"""
+
+# 直接位于某目录下的未删除文件的统计：文件数、字节数、重复文件数、重复文件字节数。
+# 重复文件指目录库中还有其他未删除文件与其 MD5 相同
+_OWN_DIR_STATS_SQL = """
+    SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(duplicate), 0),
+           COALESCE(SUM(duplicate * COALESCE(size, 0)), 0)
+    FROM (
+        SELECT f.size, f.md5 IS NOT NULL AND EXISTS (
+            SELECT 1 FROM files g WHERE g.md5 = f.md5 AND g.deleted = 0 AND g.id != f.id
+        ) AS duplicate
+        FROM files f WHERE f.directory = ? AND f.deleted = 0
+    )
+"""
+
+# 后续版本新增的列，打开旧目录库时自动补齐
+_ADDED_COLUMNS = {
+    "size": "INTEGER",   # 文件大小（字节）
+    "mtime": "INTEGER",  # 修改时间（纳秒）
+    "inode": "INTEGER",
+    "dev": "INTEGER",    # 所在设备号
+    "hash_algo": "TEXT",  # md5 列中摘要使用的算法
+    # 各哈希方法的聚类编号，哈希值变化时清空，等待增量聚类重新归组
+    "phash_cluster": "INTEGER",
+    "average_hash_cluster": "INTEGER",
+    "dhash_cluster": "INTEGER",
+}
+
+# 新增列上的索引，补齐列之后再建立
+_ADDED_INDEXES = {
+    f"idx_files_{hash_method}_cluster": f"files({hash_method}_cluster)" for hash_method in HASH_METHODS
+}
+
+# executemany 每批提交的行数
+_BATCH_SIZE = 10000
+
+
+def _check_hash_method(hash_method):
+    if hash_method not in HASH_METHODS:
+        raise ValueError(f"未知的哈希方法: {hash_method}")
+
+
+def _md5_row(row):
+    """将数据库记录转换为 1_1 输出的 CSV 行格式"""
+    return {
+        "MD5": row["md5"],
+        "文件名": row["file_name"],
+        "文件目录": row["directory"],
+        "文件路径": row["file_path"],
+        "是否删除": str(row["deleted"]),
+    }
+
+
+def _imagehash_row(row, hash_method):
+    """将数据库记录转换为 2_1 输出的 CSV 行格式"""
+    return {
+        "imagehash": row[hash_method],
+        "文件名": row["file_name"],
+        "文件目录": row["directory"],
+        "文件路径": row["file_path"],
+        "是否删除": str(row["deleted"]),
+    }
+
+
+def _dir_stats_row(row):
+    """将目录统计记录转换为字典，各项均包含子目录"""
+    return {
+        "目录": row["directory"],
+        "文件数": row["files"],
+        "文件大小": row["bytes"],
+        "重复文件数": row["duplicate_files"],
+        "重复文件大小": row["duplicate_bytes"],
+        "重复文件占比": row["duplicate_files"] / row["files"] if row["files"] else 0.0,
+    }
+
+
+def _parent_directory(directory):
+    """返回上级目录，已是根目录时返回 None"""
+    parent = os.path.dirname(directory)
+    return parent if parent and parent != directory else None
+
+
+def _prefix_range(folder):
+    """
+    返回文件夹下所有路径在文件路径索引上的区间 [下界, 上界)，
+    以分隔符结尾，避免把同名前缀的兄弟目录（如 努比亚 与 努比亚2）算进来。
+    """
+    prefix = folder.rstrip("\\/") + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def _batched(iterable, size=_BATCH_SIZE):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Catalog:
+    """
+    基于 SQLite 的文件目录库，供各阶段脚本共享。
+    一行对应一个文件，MD5、各 imagehash 和“是否删除”都在同一行中，
+    按 MD5、路径、目录和每种 imagehash 建有索引。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self._add_missing_columns()
+
+    def _add_missing_columns(self):
+        existing = {row["name"] for row in self.conn.execute("PRAGMA table_info(files)")}
+        with self.conn:
+            for column, column_type in _ADDED_COLUMNS.items():
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE files ADD COLUMN {column} {column_type}")
+            for index_name, target in _ADDED_INDEXES.items():
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {target}")
+
+    def close(self):
+        self.conn.close()
+
+    def _mark_dirty(self, file_paths):
+        # 记录文件所在目录和 MD5，目录统计据此增量更新；写入前后各调用一次，同时记录旧值和新值
+        paths = json.dumps(file_paths, ensure_ascii=False)
+        self.conn.execute("""
+            INSERT OR IGNORE INTO dirty_dirs (directory)
+            SELECT directory FROM files WHERE file_path IN (SELECT value FROM json_each(?))
+        """, (paths,))
+        self.conn.execute("""
+            INSERT OR IGNORE INTO dirty_md5s (md5)
+            SELECT md5 FROM files WHERE md5 IS NOT NULL AND file_path IN (SELECT value FROM json_each(?))
+        """, (paths,))
+
+    def _hash_state(self, file_paths):
+        # 各文件在每种哈希索引中的内容：未删除时为哈希值，已删除或没有该哈希时为 None
+        sql = f"""
+            SELECT file_path, {", ".join(f"CASE WHEN deleted = 0 THEN {method} END" for method in HASH_METHODS)}
+            FROM files WHERE file_path IN (SELECT value FROM json_each(?))
+        """
+        return {row[0]: tuple(row[1:]) for row in self.conn.execute(sql, (json.dumps(file_paths, ensure_ascii=False),))}
+
+    def _bump_generation(self, before=None, after=None):
+        # 每次写入后递增全局修改代数；比较写入前后的 _hash_state，只递增内容确实变化的哈希方法的代数，
+        # 保存在磁盘上的各哈希索引据此判断是否需要重建，MD5 和文件属性的写入不会使其失效
+        self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        before, after = before or {}, after or {}
+        empty = (None,) * len(HASH_METHODS)
+        for i, hash_method in enumerate(HASH_METHODS):
+            if any(before.get(path, empty)[i] != after.get(path, empty)[i] for path in before.keys() | after.keys()):
+                self.conn.execute("UPDATE meta SET value = value + 1 WHERE key = ?", (f"{hash_method}_generation",))
+
+    def generation(self, hash_method=None):
+        """
+        返回目录库的修改代数，任何写入都会使其增加；
+        指定 hash_method 时返回该哈希的修改代数，只有该哈希的索引内容（未删除文件的哈希值）变化时才增加
+        """
+        key = "generation"
+        if hash_method is not None:
+            _check_hash_method(hash_method)
+            key = f"{hash_method}_generation"
+        return self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()[0]
+
+    @contextmanager
+    def snapshot(self):
+        """
+        在一个读事务中执行多次查询，WAL 模式下各查询看到同一时刻的目录库，不受其他连接写入影响
+        """
+        self.conn.execute("BEGIN")
+        try:
+            yield self
+        finally:
+            self.conn.execute("COMMIT")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    # ------------------------------------------------------------------ 写入
+
+    def upsert_md5(self, rows, hash_algo="md5"):
+        """
+        写入或更新文件的 MD5。
+        :param rows: 可迭代的 (MD5, 文件名, 文件目录, 文件路径, 是否删除) 元组，
+                     可在末尾附带 (大小, 修改时间, inode, 设备号) 供增量扫描比对；
+                     未附带时清空这几列，下次增量扫描会重新计算该文件
+        :param hash_algo: 摘要使用的算法，同一目录库内应保持一致才能按 MD5 列比较
+        """
+        sql = """
+            INSERT INTO files (md5, file_name, directory, file_path, deleted, size, mtime, inode, dev, hash_algo)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+                md5 = excluded.md5,
+                hash_algo = excluded.hash_algo,
+                file_name = excluded.file_name,
+                directory = excluded.directory,
+                deleted = excluded.deleted,
+                size = excluded.size,
+                mtime = excluded.mtime,
+                inode = excluded.inode,
+                dev = excluded.dev
+        """
+        count = 0
+        for batch in _batched(rows):
+            params = []
+            for row in batch:
+                md5, name, directory, path, deleted, *stat = row
+                params.append((md5, name, directory, path, int(deleted), *(stat or (None,) * 4), hash_algo))
+            paths = [param[3] for param in params]
+            with self.conn:
+                self._mark_dirty(paths)
+                before = self._hash_state(paths)
+                self.conn.executemany(sql, params)
+                self._mark_dirty(paths)
+                self._bump_generation(before, self._hash_state(paths))
+            count += len(batch)
+        return count
+
+    def upsert_stat(self, rows):
+        """
+        写入或更新文件的大小、修改时间等属性，不计算 MD5。
+        属性与上次一致时保留已有的 MD5，否则清空 MD5，等待后续扫描重新计算。
+        :param rows: 可迭代的 (文件名, 文件目录, 文件路径, 大小, 修改时间, inode, 设备号) 元组
+        """
+        sql = """
+            INSERT INTO files (file_name, directory, file_path, deleted, size, mtime, inode, dev)
+            VALUES (?, ?, ?, 0, ?, ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+                md5 = CASE WHEN files.size IS excluded.size AND files.mtime IS excluded.mtime
+                                AND files.inode IS excluded.inode THEN files.md5 END,
+                deleted = 0,
+                size = excluded.size,
+                mtime = excluded.mtime,
+                inode = excluded.inode,
+                dev = excluded.dev
+        """
+        count = 0
+        for batch in _batched(rows):
+            paths = [row[2] for row in batch]
+            with self.conn:
+                self._mark_dirty(paths)
+                before = self._hash_state(paths)
+                self.conn.executemany(sql, batch)
+                self._mark_dirty(paths)
+                self._bump_generation(before, self._hash_state(paths))
+            count += len(batch)
+        return count
+
+    def upsert_imagehash(self, hash_method, rows):
+        """
+        写入或更新文件的某一种 imagehash。
+        :param hash_method: 哈希方法（phash、average_hash、dhash）
+        已删除的文件不会因为旧 CSV 中的“是否删除=0”被恢复，删除标记只能由 MD5 记录或 mark_deleted 清除。
+        :param rows: 可迭代的 (imagehash, 文件名, 文件目录, 文件路径, 是否删除) 元组
+        """
+        _check_hash_method(hash_method)
+        sql = f"""
+            INSERT INTO files ({hash_method}, file_name, directory, file_path, deleted)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+                {hash_method} = excluded.{hash_method},
+                {hash_method}_cluster = CASE WHEN files.{hash_method} IS excluded.{hash_method}
+                                             THEN files.{hash_method}_cluster END,
+                file_name = excluded.file_name,
+                directory = excluded.directory,
+                deleted = MAX(files.deleted, excluded.deleted)
+        """
+        count = 0
+        for batch in _batched(rows):
+            paths = [row[3] for row in batch]
+            with self.conn:
+                self._mark_dirty(paths)
+                before = self._hash_state(paths)
+                self.conn.executemany(sql, [(value, name, directory, path, int(deleted))
+                                            for value, name, directory, path, deleted in batch])
+                self._mark_dirty(paths)
+                self._bump_generation(before, self._hash_state(paths))
+            count += len(batch)
+        return count
+
+    def upsert_image_rows(self, rows):
+        """
+        写入或更新 2_1 计算出的图片记录，一行同时包含多种 imagehash。
+        :param rows: 可迭代的字典 {"文件名", "文件目录", "文件路径", "是否删除", 各哈希方法: 哈希值}，
+                     缺少的哈希方法保留原值
+        """
+        sql = """
+            INSERT INTO files (file_name, directory, file_path, deleted, phash, average_hash, dhash)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET
+                file_name = excluded.file_name,
+                directory = excluded.directory,
+                deleted = excluded.deleted,
+                phash = COALESCE(excluded.phash, files.phash),
+                average_hash = COALESCE(excluded.average_hash, files.average_hash),
+                dhash = COALESCE(excluded.dhash, files.dhash),
+                phash_cluster = CASE WHEN excluded.phash IS NULL OR excluded.phash IS files.phash
+                                     THEN files.phash_cluster END,
+                average_hash_cluster = CASE WHEN excluded.average_hash IS NULL
+                                                 OR excluded.average_hash IS files.average_hash
+                                            THEN files.average_hash_cluster END,
+                dhash_cluster = CASE WHEN excluded.dhash IS NULL OR excluded.dhash IS files.dhash
+                                     THEN files.dhash_cluster END
+        """
+        count = 0
+        for batch in _batched(rows):
+            paths = [row["文件路径"] for row in batch]
+            with self.conn:
+                self._mark_dirty(paths)
+                before = self._hash_state(paths)
+                self.conn.executemany(sql, [(row["文件名"], row["文件目录"], row["文件路径"], int(row["是否删除"]),
+                                             *(row.get(hash_method) for hash_method in HASH_METHODS))
+                                            for row in batch])
+                self._mark_dirty(paths)
+                self._bump_generation(before, self._hash_state(paths))
+            count += len(batch)
+        return count
+
+    def mark_deleted(self, file_paths, deleted=1):
+        """
+        批量更新“是否删除”标记：只修改标记确实变化的行，并在同一事务中追加到删除日志，
+        不重写整个目录库，中途中断时已提交的批次和日志保持一致。
+        :return: 实际更新的行数
+        """
+        deleted = int(deleted)
+        count = 0
+        for batch in _batched(file_paths):
+            with self.conn:
+                changed = [row[0] for row in self.conn.execute("""
+                    SELECT file_path FROM files
+                    WHERE file_path IN (SELECT value FROM json_each(?)) AND deleted != ?
+                """, (json.dumps(batch, ensure_ascii=False), deleted))]
+                if not changed:
+                    continue
+                before = self._hash_state(changed)
+                now = int(time.time())
+                self.conn.executemany("INSERT INTO deletion_journal (file_path, deleted, time) VALUES (?, ?, ?)",
+                                      [(path, deleted, now) for path in changed])
+                self.conn.executemany("UPDATE files SET deleted = ? WHERE file_path = ?",
+                                      [(deleted, path) for path in changed])
+                self._mark_dirty(changed)
+                self._bump_generation(before, self._hash_state(changed))
+            count += len(changed)
+        return count
+
+    # ------------------------------------------------------------------ 删除日志
+
+    def deletion_journal_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM deletion_journal").fetchone()[0]
+
+    def compact(self, keep_days=DEFAULT_JOURNAL_KEEP_DAYS):
+        """
+        整理目录库：清理早于 keep_days 天的删除日志（为 None 时保留全部），
+        把 WAL 日志合并回数据库并截断，再用 VACUUM 回收空闲页。VACUUM 在事务中完成，中断不会损坏目录库。
+        :return: 清理的删除日志条数
+        """
+        removed = 0
+        if keep_days is not None:
+            with self.conn:
+                cursor = self.conn.execute("DELETE FROM deletion_journal WHERE time < ?",
+                                           (int(time.time()) - keep_days * 86400,))
+            removed = cursor.rowcount
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.conn.execute("VACUUM")
+        return removed
+
+    # ------------------------------------------------------------------ 聚类状态
+
+    def cluster_threshold(self, hash_method):
+        """
+        返回保存的聚类所用的阈值，尚未聚类时返回 None
+        """
+        _check_hash_method(hash_method)
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (f"{hash_method}_cluster_threshold",)).fetchone()
+        return row[0] if row else None
+
+    def save_clusters(self, hash_method, threshold, assignments):
+        """
+        保存一次完整聚类的结果，未在 assignments 中的文件聚类编号清空。
+        聚类编号不影响哈希索引，不增加修改代数。
+        :param assignments: 可迭代的 (聚类编号, id)
+        """
+        _check_hash_method(hash_method)
+        with self.conn:
+            self.conn.execute(f"UPDATE files SET {hash_method}_cluster = NULL")
+            for batch in _batched(assignments):
+                self.conn.executemany(f"UPDATE files SET {hash_method}_cluster = ? WHERE id = ?", batch)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                              (f"{hash_method}_cluster_threshold", threshold))
+
+    def update_clusters(self, hash_method, assignments, merges):
+        """
+        增量聚类：为新文件写入聚类编号，并把被合并的聚类改为合并后的编号。
+        :param assignments: 可迭代的 (聚类编号, id)
+        :param merges: {原聚类编号: 合并后的聚类编号}
+        """
+        _check_hash_method(hash_method)
+        with self.conn:
+            self.conn.executemany(f"UPDATE files SET {hash_method}_cluster = ? WHERE {hash_method}_cluster = ?",
+                                  [(target, source) for source, target in merges.items()])
+            for batch in _batched(assignments):
+                self.conn.executemany(f"UPDATE files SET {hash_method}_cluster = ? WHERE id = ?", batch)
+
+    def iter_cluster_items(self, hash_method):
+        """
+        按 id 顺序遍历所有未删除、有指定 imagehash 的文件，产出 (id, 聚类编号)，
+        顺序与 iter_imagehash_items 一致，尚未归组的文件聚类编号为 None
+        """
+        _check_hash_method(hash_method)
+        sql = f"""
+            SELECT id, {hash_method}_cluster FROM files
+            WHERE {hash_method} IS NOT NULL AND deleted = 0 ORDER BY id
+        """
+        for row in self.conn.execute(sql):
+            yield row[0], row[1]
+
+    def iter_unclustered_items(self, hash_method):
+        """
+        按 id 顺序遍历尚未归组（聚类编号为空）的未删除文件，产出 (id, imagehash)，按聚类编号索引查询
+        """
+        _check_hash_method(hash_method)
+        sql = f"""
+            SELECT id, {hash_method} FROM files
+            WHERE {hash_method}_cluster IS NULL AND {hash_method} IS NOT NULL AND deleted = 0 ORDER BY id
+        """
+        for row in self.conn.execute(sql):
+            yield row[0], row[1]
+
+    def find_clusters(self, hash_method, ids):
+        """
+        批量查询已归组的未删除文件的聚类编号和当前哈希
+        :return: {id: (聚类编号, imagehash)}，已删除、未归组或不存在的 id 不返回
+        """
+        _check_hash_method(hash_method)
+        sql = f"""
+            SELECT id, {hash_method}_cluster, {hash_method} FROM files
+            WHERE id IN (SELECT value FROM json_each(?)) AND deleted = 0 AND {hash_method}_cluster IS NOT NULL
+        """
+        result = {}
+        for batch in _batched(ids):
+            for row in self.conn.execute(sql, (json.dumps(batch),)):
+                result[row[0]] = (row[1], row[2])
+        return result
+
+    def cluster_exists(self, hash_method, cluster):
+        _check_hash_method(hash_method)
+        sql = f"SELECT 1 FROM files WHERE {hash_method}_cluster = ? LIMIT 1"
+        return self.conn.execute(sql, (cluster,)).fetchone() is not None
+
+    def next_cluster_id(self, hash_method):
+        """
+        返回大于所有文件 id 和已有聚类编号的编号，按索引查询
+        """
+        _check_hash_method(hash_method)
+        max_id = self.conn.execute("SELECT MAX(id) FROM files").fetchone()[0] or 0
+        max_cluster = self.conn.execute(f"SELECT MAX({hash_method}_cluster) FROM files").fetchone()[0] or 0
+        return max(max_id, max_cluster) + 1
+
+    # ------------------------------------------------------------------ 目录统计
+
+    def refresh_dir_stats(self):
+        """
+        增量更新目录统计表：只重新统计写入时记录的目录中直接包含的文件，
+        再把变化量逐级加到所有上级目录，每个目录的统计都包含其子目录。
+        首次调用时统计全部目录。
+        :return: 重新统计的目录数
+        """
+        with self.conn:
+            built = self.conn.execute("SELECT value FROM meta WHERE key = 'dir_stats_built'").fetchone()
+            if not built:
+                self.conn.execute("DELETE FROM dir_stats")
+                self.conn.execute("INSERT OR IGNORE INTO dirty_dirs (directory) SELECT DISTINCT directory FROM files")
+                self.conn.execute("INSERT INTO meta (key, value) VALUES ('dir_stats_built', 1)")
+
+            self.conn.execute("""
+                INSERT OR IGNORE INTO dirty_dirs (directory)
+                SELECT DISTINCT directory FROM files WHERE md5 IN (SELECT md5 FROM dirty_md5s)
+            """)
+            dirty = [row[0] for row in self.conn.execute("SELECT directory FROM dirty_dirs")]
+            deltas = {}
+            for directory in dirty:
+                new = self.conn.execute(_OWN_DIR_STATS_SQL, (directory,)).fetchone()
+                old = self.conn.execute("""
+                    SELECT own_files, own_bytes, own_duplicate_files, own_duplicate_bytes FROM dir_stats
+                    WHERE directory = ?
+                """, (directory,)).fetchone() or (0, 0, 0, 0)
+                delta = [new_value - old_value for new_value, old_value in zip(new, old)]
+                if not any(delta):
+                    continue
+                self.conn.execute("""
+                    INSERT INTO dir_stats (directory, parent, own_files, own_bytes, own_duplicate_files,
+                                           own_duplicate_bytes)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(directory) DO UPDATE SET
+                        own_files = excluded.own_files,
+                        own_bytes = excluded.own_bytes,
+                        own_duplicate_files = excluded.own_duplicate_files,
+                        own_duplicate_bytes = excluded.own_duplicate_bytes
+                """, (directory, _parent_directory(directory), *new))
+                # 变化量累加到该目录及所有上级目录
+                ancestor = directory
+                while ancestor is not None:
+                    totals = deltas.setdefault(ancestor, [0, 0, 0, 0])
+                    for i, value in enumerate(delta):
+                        totals[i] += value
+                    ancestor = _parent_directory(ancestor)
+
+            self.conn.executemany("""
+                INSERT INTO dir_stats (directory, parent, files, bytes, duplicate_files, duplicate_bytes)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(directory) DO UPDATE SET
+                    files = files + excluded.files,
+                    bytes = bytes + excluded.bytes,
+                    duplicate_files = duplicate_files + excluded.duplicate_files,
+                    duplicate_bytes = duplicate_bytes + excluded.duplicate_bytes
+            """, [(directory, _parent_directory(directory), *totals) for directory, totals in deltas.items()])
+            self.conn.execute("DELETE FROM dir_stats WHERE files = 0")
+            self.conn.execute("DELETE FROM dirty_dirs")
+            self.conn.execute("DELETE FROM dirty_md5s")
+        return len(dirty)
+
+    def directory_stats(self, directory):
+        """
+        返回目录（含子目录）的统计：文件数、文件大小、重复文件数、重复文件大小、重复文件占比，
+        目录不存在或没有未删除的文件时返回 None
+        """
+        self.refresh_dir_stats()
+        row = self.conn.execute("SELECT * FROM dir_stats WHERE directory = ?",
+                                (os.path.normpath(directory),)).fetchone()
+        return _dir_stats_row(row) if row else None
+
+    def child_directory_stats(self, directory=None, limit=None):
+        """
+        返回目录的各直接子目录的统计，按重复文件大小（可释放空间）降序排列。
+        :param directory: 为空时返回各根目录（如各盘符）
+        """
+        self.refresh_dir_stats()
+        sql = "SELECT * FROM dir_stats WHERE parent IS ? ORDER BY duplicate_bytes DESC, directory"
+        params = (os.path.normpath(directory) if directory else None,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        return [_dir_stats_row(row) for row in self.conn.execute(sql, params)]
+
+    # ------------------------------------------------------------------ 查询
+
+    def iter_md5_rows(self, include_deleted=False):
+        """
+        按 1_1 的 CSV 行格式遍历所有有 MD5 的文件，默认只返回未删除的文件。
+        """
+        sql = "SELECT * FROM files WHERE md5 IS NOT NULL"
+        if not include_deleted:
+            sql += " AND deleted = 0"
+        for row in self.conn.execute(sql):
+            yield _md5_row(row)
+
+    def iter_md5_rows_under(self, folder, include_deleted=False):
+        """
+        按文件路径索引遍历给定文件夹（含子目录）下有 MD5 的文件，耗时与结果数成正比。
+        按路径分量匹配，同名前缀的兄弟目录（如 努比亚 与 努比亚2）不会被算进来。
+        """
+        sql = "SELECT * FROM files WHERE file_path >= ? AND file_path < ? AND md5 IS NOT NULL"
+        if not include_deleted:
+            sql += " AND deleted = 0"
+        for row in self.conn.execute(sql, _prefix_range(folder)):
+            yield _md5_row(row)
+
+    def iter_imagehash_rows(self, hash_method, include_deleted=False):
+        """
+        按 2_1 的 CSV 行格式遍历所有有指定 imagehash 的文件，默认只返回未删除的文件。
+        """
+        _check_hash_method(hash_method)
+        sql = f"SELECT * FROM files WHERE {hash_method} IS NOT NULL"
+        if not include_deleted:
+            sql += " AND deleted = 0"
+        for row in self.conn.execute(sql):
+            yield _imagehash_row(row, hash_method)
+
+    def iter_imagehash_items(self, hash_method, include_deleted=False):
+        """
+        按 id 顺序遍历所有有指定 imagehash 的文件，产出 (id, 2_1 的 CSV 行)。
+        顺序固定，供按位打包的哈希数组和近邻索引使用。
+        """
+        _check_hash_method(hash_method)
+        sql = f"SELECT * FROM files WHERE {hash_method} IS NOT NULL"
+        if not include_deleted:
+            sql += " AND deleted = 0"
+        for row in self.conn.execute(sql + " ORDER BY id"):
+            yield row["id"], _imagehash_row(row, hash_method)
+
+    def find_by_ids(self, ids, hash_method=None):
+        """
+        按 id 批量查询文件。
+        :param hash_method: 为空时返回 1_1 的 CSV 行格式，否则返回 2_1 的 CSV 行格式
+        :return: {id: 行}
+        """
+        rows = {}
+        for batch in _batched(ids, 500):
+            placeholders = ",".join("?" * len(batch))
+            for row in self.conn.execute(f"SELECT * FROM files WHERE id IN ({placeholders})", batch):
+                rows[row["id"]] = _imagehash_row(row, hash_method) if hash_method else _md5_row(row)
+        return rows
+
+    def load_directory_state(self, directory):
+        """
+        读取直接位于给定目录下的文件上次扫描时的状态，用于增量扫描。
+        :return: {文件路径: (大小, 修改时间, inode, MD5, 是否删除, 摘要算法)}
+        """
+        sql = """
+            SELECT file_path, size, mtime, inode, md5, deleted, hash_algo FROM files
+            WHERE directory = ?
+        """
+        return {row["file_path"]: (row["size"], row["mtime"], row["inode"], row["md5"], row["deleted"],
+                                   row["hash_algo"] or "md5")
+                for row in self.conn.execute(sql, (directory,))}
+
+    def iter_paths_under(self, folders, include_deleted=False):
+        """
+        按文件路径索引遍历给定文件夹（含子目录）下的文件，产出 (文件路径, 文件目录)。
+        """
+        sql = "SELECT file_path, directory FROM files WHERE file_path >= ? AND file_path < ?"
+        if not include_deleted:
+            sql += " AND deleted = 0"
+        for folder in folders:
+            for row in self.conn.execute(sql, _prefix_range(folder)):
+                yield row["file_path"], row["directory"]
+
+    def all_paths(self, include_deleted=False):
+        sql = "SELECT file_path FROM files"
+        if not include_deleted:
+            sql += " WHERE deleted = 0"
+        return [row[0] for row in self.conn.execute(sql)]
+
+    # ------------------------------------------------------------------ CSV 导入
+
+    def import_md5_csv(self, csv_path):
+        """
+        导入 1_1 生成的 MD5 CSV（MD5,文件名,文件目录,文件路径,是否删除）。
+        """
+        with open(csv_path, mode="r", encoding="utf-8") as file:
+            reader = csv.DictReader(file)
+            rows = ((row["MD5"], row["文件名"], row["文件目录"], row["文件路径"], row["是否删除"] or 0)
+                    for row in reader)
+            return self.upsert_md5(rows)
+
+    def import_imagehash_csv(self, csv_path, hash_method):
+        """
+        导入 2_1 生成的 imagehash CSV（imagehash,文件名,文件目录,文件路径,是否删除）。
+        """
+        with open(csv_path, mode="r", encoding="utf-8") as file:
+            reader = csv.DictReader(file)
+            rows = ((row["imagehash"], row["文件名"], row["文件目录"], row["文件路径"], row["是否删除"] or 0)
+                    for row in reader)
+            return self.upsert_imagehash(hash_method, rows)
+
+
+def catalog_path(name, base_dir=None):
+    """
+    返回共享目录库文件路径，默认位于 csv计算版 目录下，例如 处理总文件.db。
+    """
+    if base_dir is None:
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_dir, f"{name}.db")
@@ -0,0 +1,353 @@
+import csv
+import os
+from functools import partial
+
+import numpy as np
+from tqdm import tqdm
+
+from common.catalog import Catalog
+from common.hash_index import MultiIndexHash, index_path
+from common.hash_store import HashStore, popcount64
+from common.pipeline import run_process_pipeline
+
+# 每个进程任务处理的哈希数
+PARTITION_SIZE = 4096
+
+# 子进程中加载的近邻索引
+_worker_index = None
+
+
+class UnionFind:
+    """
+    并查集：按大小合并、路径减半，合并结果与候选对的顺序无关
+    """
+
+    def __init__(self, size):
+        self.parent = list(range(size))
+        self.size = [1] * size
+
+    def find(self, x):
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a == root_b:
+            return False
+        if self.size[root_a] < self.size[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        self.size[root_a] += self.size[root_b]
+        return True
+
+    def union_pairs(self, lefts, rights):
+        for a, b in zip(lefts.tolist(), rights.tolist()):
+            self.union(a, b)
+
+    def groups(self):
+        """
+        返回所有组，每组为升序的成员下标，组按最小成员下标排序
+        """
+        groups = {}
+        for x in range(len(self.parent)):
+            groups.setdefault(self.find(x), []).append(x)
+        return list(groups.values())
+
+
+def _init_worker(index_path):
+    global _worker_index
+    _worker_index = MultiIndexHash.load(index_path)
+
+
+def _candidate_pairs(partitions, threshold):
+    """
+    进程任务：对一批分区内的每个哈希查询近邻，返回汉明距离不超过阈值的候选对 (i, j, 距离)，i < j
+    """
+    lefts, rights = [], []
+    for start, stop in partitions:
+        for i in range(start, stop):
+            neighbours = _worker_index.query(_worker_index.hashes[i], threshold)
+            neighbours = neighbours[neighbours > i]
+            if len(neighbours):
+                lefts.append(np.full(len(neighbours), i, dtype=np.uint32))
+                rights.append(neighbours.astype(np.uint32))
+    if not lefts:
+        return []
+    lefts, rights = np.concatenate(lefts), np.concatenate(rights)
+    distances = popcount64(_worker_index.hashes[lefts] ^ _worker_index.hashes[rights]).astype(np.uint8)
+    return [(lefts, rights, distances)]
+
+
+def compute_edges(index_path, size, max_distance, num_workers=None, partition_size=PARTITION_SIZE):
+    """
+    计算汉明距离不超过 max_distance 的所有相似边：把哈希按下标分区交给多个进程，
+    每个进程用近邻索引查找。
+    :param index_path: 已保存的近邻索引文件（各进程分别加载）
+    :param size: 索引中的哈希数
+    :param max_distance: 最大汉明距离
+    :param num_workers: 进程数，默认为 CPU 核数
+    :param partition_size: 每个进程任务处理的哈希数
+    :return: (起点下标 uint32, 终点下标 uint32, 距离 uint8)，下标对应索引中哈希的顺序
+    """
+    partitions = [(start, min(start + partition_size, size)) for start in range(0, size, partition_size)]
+    results = run_process_pipeline(partitions, partial(_candidate_pairs, threshold=max_distance),
+                                   num_workers=num_workers, chunk_size=1,
+                                   initializer=_init_worker, initargs=(index_path,))
+    edges = list(tqdm(results, desc="查找相似图片", unit="批"))
+    if not edges:
+        return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint8)
+    return tuple(np.concatenate(columns) for columns in zip(*edges))
+
+
+def groups_from_edges(size, lefts, rights, distances, threshold):
+    """
+    用并查集合并距离不超过 threshold 的边，得到连通分组
+    :return: [[下标, ...], ...]，每组成员升序，组按最小成员下标排序
+    """
+    union_find = UnionFind(size)
+    selected = distances <= threshold
+    union_find.union_pairs(lefts[selected], rights[selected])
+    return union_find.groups()
+
+
+def cluster_index(index_path, size, threshold, num_workers=None, partition_size=PARTITION_SIZE):
+    """
+    聚类：多进程找出汉明距离不超过阈值的候选对，当前进程用并查集合并，得到连通分组。
+    :return: [[下标, ...], ...]，下标对应索引中哈希的顺序
+    """
+    edges = compute_edges(index_path, size, threshold, num_workers=num_workers, partition_size=partition_size)
+    return groups_from_edges(size, *edges, threshold)
+
+
+def threshold_summary(size, lefts, rights, distances, max_distance):
+    """
+    按距离从小到大依次合并边，统计每个阈值下的分组情况。
+    :return: [{"阈值", "相似组数", "相似组中的文件数", "最大组文件数"}, ...]
+    """
+    union_find = UnionFind(size)
+    order = np.argsort(distances, kind="stable")
+    lefts, rights, distances = lefts[order].tolist(), rights[order].tolist(), distances[order].tolist()
+    group_count = grouped_files = largest = 0
+    summary = []
+    position = 0
+    for threshold in range(max_distance + 1):
+        while position < len(distances) and distances[position] <= threshold:
+            root_a, root_b = union_find.find(lefts[position]), union_find.find(rights[position])
+            if root_a != root_b:
+                size_a, size_b = union_find.size[root_a], union_find.size[root_b]
+                # 两个单独文件合并产生一个新组；已有组吸收单独文件只增加文件数；两个组合并减少一个组
+                if size_a == 1 and size_b == 1:
+                    group_count += 1
+                    grouped_files += 2
+                elif size_a == 1 or size_b == 1:
+                    grouped_files += 1
+                else:
+                    group_count -= 1
+                union_find.union(root_a, root_b)
+                largest = max(largest, size_a + size_b)
+            position += 1
+        summary.append({"阈值": threshold, "相似组数": group_count, "相似组中的文件数": grouped_files,
+                        "最大组文件数": largest})
+    return summary
+
+
+def save_cluster_groups(db_path, hash_method, threshold, ids, groups):
+    """
+    把一次完整聚类的结果保存到目录库，聚类编号取组内最小的目录库 id，供之后增量聚类使用。
+    :param ids: 与下标对应的目录库 id（升序）
+    :param groups: [[下标, ...], ...]，每组成员升序
+    """
+    assignments = ((int(ids[members[0]]), int(ids[i])) for members in groups for i in members)
+    with Catalog(db_path) as catalog:
+        catalog.save_clusters(hash_method, threshold, assignments)
+
+
+def assign_new_members(new_ids, new_hashes, neighbour_clusters, threshold, cluster_exists, next_cluster_id):
+    """
+    增量聚类：把新文件归入已有聚类或新建聚类，新文件之间的近邻用暴力比较，
+    新文件把多个已有聚类连接起来时合并这些聚类（保留编号最小的聚类）。
+    :param new_ids: 新文件的目录库 id（升序）
+    :param new_hashes: 与 new_ids 对应的哈希（uint64）
+    :param neighbour_clusters: 与 new_ids 对应，每个新文件的近邻所属的已有聚类编号集合
+    :param threshold: 聚类时使用的汉明距离阈值
+    :param cluster_exists: 判断聚类编号是否已被使用的函数
+    :param next_cluster_id: 新建聚类时，组内最小的 id 已被占用时使用的起始编号
+    :return: ({新文件 id: 聚类编号}, {被合并的聚类编号: 合并后的聚类编号})
+    """
+    # 已有聚类的标签为 (0, 聚类编号)，新文件的临时标签为 (1, 下标)，合并时保留较小的标签
+    parent = {}
+
+    def find(label):
+        while parent.get(label, label) != label:
+            parent[label] = parent.get(parent[label], parent[label])
+            label = parent[label]
+        return label
+
+    def union(label_a, label_b):
+        root_a, root_b = find(label_a), find(label_b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    for position, clusters in enumerate(neighbour_clusters):
+        for cluster in clusters:
+            union((1, position), (0, int(cluster)))
+    for position in range(len(new_hashes) - 1):
+        distances = popcount64(new_hashes[position + 1:] ^ new_hashes[position])
+        for neighbour in np.flatnonzero(distances <= threshold) + position + 1:
+            union((1, position), (1, int(neighbour)))
+
+    # 全部由新文件组成的聚类分配新编号：优先使用组内最小的目录库 id
+    allocated = {}
+    used = set()
+    assignments = {}
+    for position, file_id in enumerate(new_ids.tolist()):
+        kind, value = find((1, position))
+        if kind == 0:
+            assignments[file_id] = value
+            continue
+        if value not in allocated:
+            candidate = int(new_ids[value])
+            if candidate in used or cluster_exists(candidate):
+                candidate, next_cluster_id = next_cluster_id, next_cluster_id + 1
+            used.add(candidate)
+            allocated[value] = candidate
+        assignments[file_id] = allocated[value]
+
+    merges = {}
+    for label in list(parent):
+        root = find(label)
+        if label[0] == 0 and root != label:
+            merges[label[1]] = root[1]
+    return assignments, merges
+
+
+def _append_new_hashes(index, new_ids, new_hashes):
+    """
+    把索引中还没有的新文件（或哈希已变化的文件）追加到索引
+    """
+    known = {}
+    for position in np.flatnonzero(np.isin(index.ids, new_ids)):
+        known.setdefault(int(index.ids[position]), set()).add(int(index.hashes[position]))
+    missing = np.array([int(value) not in known.get(file_id, ()) for file_id, value in
+                        zip(new_ids.tolist(), new_hashes.tolist())], dtype=bool)
+    if missing.any():
+        index.append(new_hashes[missing], new_ids[missing])
+    return int(missing.sum())
+
+
+def update_clusters_incrementally(db_path, hash_methods):
+    """
+    新文件计算哈希后调用：对已做过完整聚类的哈希方法，只读取新文件（聚类编号为空），
+    在已保存的近邻索引中查询新文件的近邻，新文件之间暴力比较，更新目录库中的聚类编号，
+    再把新文件追加到索引，耗时与新文件数成正比，不重新读取全部哈希、不重建索引。
+    索引中已删除或哈希已变化的旧条目按目录库的当前状态过滤。
+    文件被删除不会拆分已有聚类，需要时重新运行 2_2 完整聚类。
+    """
+    for hash_method in hash_methods:
+        with Catalog(db_path) as catalog, catalog.snapshot():
+            threshold = catalog.cluster_threshold(hash_method)
+            if threshold is None:
+                continue
+            new_items = list(catalog.iter_unclustered_items(hash_method))
+        if not new_items:
+            continue
+        new_ids = np.fromiter((file_id for file_id, _ in new_items), dtype=np.int64, count=len(new_items))
+        new_hashes = np.fromiter((int(value, 16) for _, value in new_items), dtype=np.uint64, count=len(new_items))
+
+        path = index_path(db_path, hash_method)
+        if os.path.exists(path):
+            index = MultiIndexHash.load(path)
+        else:
+            index = MultiIndexHash.from_store(HashStore.from_catalog(db_path, hash_method))
+
+        # 在索引中查询每个新文件的近邻，排除新文件自己（新文件之间另行比较）
+        new_id_set = set(new_ids.tolist())
+        neighbours = []
+        for value in new_hashes:
+            positions = index.query(value, threshold)
+            neighbours.append([(int(index.ids[position]), int(index.hashes[position])) for position in positions
+                               if int(index.ids[position]) not in new_id_set])
+
+        with Catalog(db_path) as catalog:
+            existing = catalog.find_clusters(hash_method, list({file_id for items in neighbours
+                                                                for file_id, _ in items}))
+            # 只保留目录库中仍未删除、哈希与索引中一致的近邻
+            neighbour_clusters = [{existing[file_id][0] for file_id, value in items
+                                   if file_id in existing and int(existing[file_id][1], 16) == value}
+                                  for items in neighbours]
+            assignments, merges = assign_new_members(new_ids, new_hashes, neighbour_clusters, threshold,
+                                                     partial(catalog.cluster_exists, hash_method),
+                                                     catalog.next_cluster_id(hash_method))
+            catalog.update_clusters(hash_method, [(cluster, file_id) for file_id, cluster in assignments.items()],
+                                    merges)
+
+        # 追加到索引并保存，下次增量聚类和 2_2 直接加载
+        appended = _append_new_hashes(index, new_ids, new_hashes)
+        if appended:
+            index.save(path)
+        print(f"{hash_method} 增量聚类（阈值 {threshold}）：{len(new_ids)} 个新图片已归组，"
+              f"合并了 {len(merges)} 个已有聚类，索引追加 {appended} 个哈希")
+
+
+def edges_path(db_path, hash_method):
+    """
+    返回目录库某种哈希的相似边文件路径，例如 处理总文件.dhash.edges.npz
+    """
+    return f"{os.path.splitext(db_path)[0]}.{hash_method}.edges.npz"
+
+
+def save_edges(path, lefts, rights, distances, ids, max_distance, generation=None):
+    """
+    保存相似边：每条边 9 字节（两个 uint32 下标和一个 uint8 距离），并保存下标对应的目录库 id
+    """
+    np.savez(path, lefts=lefts, rights=rights, distances=distances, ids=ids, max_distance=max_distance,
+             generation=-1 if generation is None else generation)
+
+
+def load_edges(path):
+    """
+    读取相似边文件
+    :return: {"lefts", "rights", "distances", "ids", "max_distance", "generation"}
+    """
+    with np.load(path) as data:
+        edges = {key: data[key] for key in ("lefts", "rights", "distances", "ids")}
+        edges["max_distance"] = int(data["max_distance"])
+        generation = int(data["generation"])
+        edges["generation"] = None if generation < 0 else generation
+    return edges
+
+
+def write_groups_csv(groups, output_csv):
+    """
+    按 2_2 的分组格式写出 CSV（文件数、文件名N、文件目录N、文件路径N，字段名升序），供前端页面读取。
+    :param groups: [[文件信息(2_1 的 CSV 行格式), ...], ...]
+    """
+    # 准备输出数据
+    output_data = []
+    for group in groups:
+        row = {"文件数": len(group)}
+        for i, file in enumerate(group):
+            row[f"文件名{i+1}"] = file["文件名"]
+            row[f"文件目录{i+1}"] = file["文件目录"]
+            row[f"文件路径{i+1}"] = file["文件路径"]
+        output_data.append(row)
+
+    # 确定所有字段名并排序
+    max_files = max((len(group) for group in groups), default=0)
+    fieldnames = ["文件数"]
+    for i in range(1, max_files + 1):
+        fieldnames.extend([f"文件名{i}", f"文件目录{i}", f"文件路径{i}"])
+    fieldnames = sorted(fieldnames)  # 按升序排序字段名
+
+    # 写入输出文件
+    with open(output_csv, mode="w", newline="", encoding="utf-8") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+
+        writer.writeheader()
+        for row in output_data:
+            # 对 row 的键进行排序
+            sorted_row = {key: row.get(key, "") for key in fieldnames}
+            writer.writerow(sorted_row)
@@ -0,0 +1,108 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from tqdm import tqdm
+
+from common.hashing import calculate_digest, new_hasher
+
+# 头尾各读取的字节数
+PARTIAL_SIZE = 8 * 1024
+
+
+def partial_digest(file_path, size, partial_size=PARTIAL_SIZE, algorithm="md5"):
+    """
+    读取文件头尾各 partial_size 字节计算摘要。
+    文件不大于 2 * partial_size 时会读完整个文件，此时返回的就是完整摘要。
+    :return: (摘要, 是否已读完整个文件, 读取字节数)，读取失败时摘要为 None
+    """
+    hasher = new_hasher(algorithm)
+    try:
+        with open(file_path, "rb") as f:
+            if size <= 2 * partial_size:
+                data = f.read()
+                hasher.update(data)
+                return hasher.hexdigest(), True, len(data)
+            head = f.read(partial_size)
+            f.seek(-partial_size, os.SEEK_END)
+            tail = f.read(partial_size)
+            hasher.update(head)
+            hasher.update(tail)
+            return hasher.hexdigest(), False, len(head) + len(tail)
+    except Exception as e:
+        print(f"无法读取文件 {file_path}，错误: {e}")
+        return None, False, 0
+
+
+def _colliding(buckets):
+    """只保留有 2 个及以上文件的分组"""
+    return [entries for entries in buckets.values() if len(entries) > 1]
+
+
+def find_duplicates(entries, num_threads=None, algorithm="md5"):
+    """
+    分级查重：先按文件大小分组，只对大小相同的文件读取头尾计算摘要，
+    只对头尾摘要仍然相同的文件计算完整 MD5。
+    :param entries: 文件列表，每项为 (文件名, 文件目录, 文件路径, (大小, 修改时间, inode, 设备号))
+    :param num_threads: 线程数
+    :param algorithm: 摘要算法，默认 md5
+    :return: ({文件路径: MD5}, 统计信息)。只包含可能重复、已计算出完整 MD5 的文件
+    """
+    md5_map = {}
+    empty_digest = new_hasher(algorithm).hexdigest()
+    stats = {"文件数": len(entries), "总字节数": 0, "读取字节数": 0}
+
+    # 第一级：按大小分组
+    size_buckets = defaultdict(list)
+    for entry in entries:
+        size = entry[3][0]
+        stats["总字节数"] += size
+        size_buckets[size].append(entry)
+
+    candidates = []
+    for entries_of_size in _colliding(size_buckets):
+        if entries_of_size[0][3][0] == 0:
+            # 空文件不需要读取
+            for entry in entries_of_size:
+                md5_map[entry[2]] = empty_digest
+        else:
+            candidates.extend(entries_of_size)
+    stats["大小相同的文件数"] = len(candidates) + len(md5_map)
+
+    # 第二级：按 (大小, 头尾摘要) 分组
+    partial_buckets = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = executor.map(lambda entry: partial_digest(entry[2], entry[3][0], algorithm=algorithm), candidates)
+        for entry, (digest, complete, read_bytes) in tqdm(zip(candidates, results), total=len(candidates),
+                                                         desc="计算头尾摘要", unit="文件"):
+            stats["读取字节数"] += read_bytes
+            if digest is None:
+                continue
+            if complete:
+                # 小文件已读完，摘要即完整 MD5
+                md5_map[entry[2]] = digest
+            else:
+                partial_buckets[(entry[3][0], digest)].append(entry)
+
+    # 第三级：计算完整 MD5
+    full_candidates = [entry for bucket in _colliding(partial_buckets) for entry in bucket]
+    stats["头尾相同的文件数"] = len(full_candidates)
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        results = executor.map(lambda entry: calculate_digest(entry[2], algorithm), full_candidates)
+        for entry, md5 in tqdm(zip(full_candidates, results), total=len(full_candidates),
+                               desc="计算完整 MD5", unit="文件"):
+            if md5:
+                stats["读取字节数"] += entry[3][0]
+                md5_map[entry[2]] = md5
+
+    return md5_map, stats
+
+
+def group_by_md5(md5_map):
+    """
+    按 MD5 分组，只返回有重复的分组 {MD5: [文件路径, ...]}
+    """
+    groups = defaultdict(list)
+    for file_path, md5 in md5_map.items():
+        groups[md5].append(file_path)
+    return {md5: sorted(paths) for md5, paths in groups.items() if len(paths) > 1}
@@ -0,0 +1,115 @@
+import os
+
+from common.catalog import Catalog
+
+
+def split_directory(directory):
+    """
+    把目录拆成路径分量，结尾的分隔符和多余的分隔符不影响结果。
+    """
+    directory = directory.rstrip("\\/")
+    if not directory:
+        return []
+    return os.path.normpath(directory).split(os.sep)
+
+
+def is_same_or_under(directory, parent):
+    """
+    按路径分量判断 directory 是否为 parent 或其子目录（努比亚2 不属于 努比亚）。
+    """
+    parts, parent_parts = split_directory(directory), split_directory(parent)
+    return parts[:len(parent_parts)] == parent_parts
+
+
+class _Node:
+    __slots__ = ("children", "items", "size")
+
+    def __init__(self):
+        self.children = {}
+        self.items = {}  # 直接位于该目录下的文件，{键: 值}
+        self.size = 0    # 子树中的文件数
+
+
+class DirectoryTree:
+    """
+    按路径分量组织的目录前缀树：每个节点对应一个目录，保存直接位于其中的文件和子树文件数。
+    查询某目录（含子目录）下的文件只访问该子树，耗时与结果数成正比；
+    子树文件数随增删同步维护，查询只需沿路径走到该节点。
+    """
+
+    def __init__(self):
+        self.root = _Node()
+
+    def _find(self, directory):
+        node = self.root
+        for part in split_directory(directory):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def add(self, directory, key, value):
+        """
+        把文件加入目录，key 在目录内唯一（例如文件路径），重复加入时覆盖
+        """
+        path = [self.root]
+        for part in split_directory(directory):
+            path.append(path[-1].children.setdefault(part, _Node()))
+        if key not in path[-1].items:
+            for node in path:
+                node.size += 1
+        path[-1].items[key] = value
+
+    def remove(self, directory, key):
+        """
+        从目录中移除文件，返回被移除的值，不存在时返回 None
+        """
+        path = [self.root]
+        for part in split_directory(directory):
+            node = path[-1].children.get(part)
+            if node is None:
+                return None
+            path.append(node)
+        if key not in path[-1].items:
+            return None
+        for node in path:
+            node.size -= 1
+        return path[-1].items.pop(key)
+
+    def count(self, directory):
+        """
+        返回目录（含子目录）下的文件数
+        """
+        node = self._find(directory)
+        return node.size if node else 0
+
+    def iter_under(self, directory, exclude=()):
+        """
+        遍历目录（含子目录）下的所有文件值，跳过 exclude 中的目录及其子目录
+        """
+        node = self._find(directory)
+        if node is None:
+            return
+        excluded = {id(excluded_node) for excluded_node in map(self._find, exclude) if excluded_node is not None}
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if id(node) in excluded:
+                continue
+            yield from node.items.values()
+            stack.extend(node.children.values())
+
+
+def print_directory_stats(db_path, directories):
+    """
+    打印目录（含子目录）的统计，便于判断在哪个目录删除能释放更多空间。
+    """
+    with Catalog(db_path) as catalog:
+        for directory in directories:
+            stats = catalog.directory_stats(directory)
+            if stats is None:
+                print(f"目录【{directory}】没有未删除的文件")
+                continue
+            print(f"目录【{directory}】共 {stats['文件数']} 个文件，{stats['文件大小'] / 1024 / 1024:.1f} MB，"
+                  f"其中在其他位置也存在的文件 {stats['重复文件数']} 个（{stats['重复文件占比']:.1%}），"
+                  f"{stats['重复文件大小'] / 1024 / 1024:.1f} MB")
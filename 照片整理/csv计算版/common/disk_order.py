@@ -0,0 +1,88 @@
+import errno
+import os
+import struct
+import sys
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl
+    fcntl = None
+
+# 每批排序的任务数：批内按物理位置排序，内存占用与文件总数无关
+DEFAULT_WINDOW = 4096
+
+# Linux FIEMAP 接口：struct fiemap 头部 32 字节，后接 struct fiemap_extent（56 字节）
+_FS_IOC_FIEMAP = 0xC020660B
+_FIEMAP_HEADER = struct.Struct("=QQIIII")
+_FIEMAP_EXTENT = struct.Struct("=QQQQQIIII")
+_FIEMAP_MAX_LENGTH = 0xFFFFFFFFFFFFFFFF
+
+# 文件系统不支持 FIEMAP 时关闭，之后直接按 inode 排序
+_fiemap_supported = fcntl is not None and sys.platform.startswith("linux")
+
+
+def fiemap_offset(file_path):
+    """
+    通过 FIEMAP 获取文件第一个数据块在磁盘上的物理偏移（仅 Linux）。
+    :return: 物理偏移（字节），平台或文件系统不支持、空文件、读取失败时返回 None
+    """
+    global _fiemap_supported
+    if not _fiemap_supported:
+        return None
+
+    request = bytearray(_FIEMAP_HEADER.size + _FIEMAP_EXTENT.size)
+    _FIEMAP_HEADER.pack_into(request, 0, 0, _FIEMAP_MAX_LENGTH, 0, 0, 1, 0)
+    try:
+        with open(file_path, "rb") as f:
+            fcntl.ioctl(f.fileno(), _FS_IOC_FIEMAP, request)
+    except OSError as e:
+        if e.errno in (errno.ENOTTY, errno.EOPNOTSUPP):
+            _fiemap_supported = False
+        return None
+
+    mapped_extents = _FIEMAP_HEADER.unpack_from(request, 0)[3]
+    if not mapped_extents:
+        return None
+    return _FIEMAP_EXTENT.unpack_from(request, _FIEMAP_HEADER.size)[1]
+
+
+def physical_key(file_path, inode=None):
+    """
+    返回文件的物理顺序排序键：支持 FIEMAP 时按第一个数据块的物理偏移，否则按 inode
+    （NTFS 上为文件编号，通常与分配顺序接近）。
+    :param inode: 已知的 inode，为空时读取文件属性
+    """
+    offset = fiemap_offset(file_path)
+    if offset is not None:
+        return 0, offset
+    if inode is None:
+        try:
+            inode = os.stat(file_path).st_ino
+        except OSError:
+            inode = 0
+    return 1, inode
+
+
+def _sorted_batch(batch, path_of, inode_of):
+    keys = [physical_key(path_of(task), inode_of(task) if inode_of else None) for task in batch]
+    order = sorted(range(len(batch)), key=keys.__getitem__)
+    return [batch[index] for index in order]
+
+
+def iter_physical_order(tasks, path_of, inode_of=None, window=DEFAULT_WINDOW):
+    """
+    机械硬盘模式：每 window 个任务为一批，批内按物理位置排序后产出，
+    配合少量读取线程使磁头基本顺序移动，减少随机寻道。
+    :param tasks: 任务的可迭代对象（同一设备上的文件）
+    :param path_of: 从任务中取文件路径的函数
+    :param inode_of: 从任务中取 inode 的函数，为空时按需读取文件属性
+    :param window: 每批排序的任务数
+    """
+    batch = []
+    for task in tasks:
+        batch.append(task)
+        if len(batch) >= window:
+            yield from _sorted_batch(batch, path_of, inode_of)
+            batch = []
+    if batch:
+        yield from _sorted_batch(batch, path_of, inode_of)
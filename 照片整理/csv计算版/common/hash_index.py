@@ -0,0 +1,179 @@
+import itertools
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from common.catalog import Catalog
+from common.hash_store import HashStore, popcount64
+
+# 默认把 64 位哈希分成 4 段，每段 16 位
+DEFAULT_BANDS = 4
+
+# 每段枚举的最大汉明半径，超过时（阈值很大）直接线性扫描更快
+MAX_PROBE_RADIUS = 3
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(radius, bits):
+    """
+    返回在低 bits 位内翻转不超过 radius 位的所有掩码，与段值异或即得到所有相近的段值
+    """
+    masks = [0]
+    for distance in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), distance):
+            masks.append(sum(1 << position for position in positions))
+    return np.array(masks, dtype=np.uint64)
+
+
+class MultiIndexHash:
+    """
+    多索引哈希（Multi-Index Hashing）：把 64 位哈希分成 num_bands 段，每段按值排序建立索引。
+    两个哈希的汉明距离不超过 k 时，由抽屉原理至少有一段的距离不超过 k // num_bands，
+    因此只需在每段中查找相近的段值得到候选，再用异或加 popcount 精确过滤。
+    可以保存为 .npz 文件，目录库中该哈希未修改时直接加载，无需重建。
+    """
+
+    def __init__(self, hashes, ids, num_bands=DEFAULT_BANDS, generation=None):
+        """
+        :param hashes: 哈希整数序列（uint64）
+        :param ids: 与哈希一一对应的目录库 id
+        :param num_bands: 分段数，必须能整除 64
+        :param generation: 建立索引时目录库中该哈希的修改代数
+        """
+        if 64 % num_bands:
+            raise ValueError(f"分段数必须能整除 64: {num_bands}")
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.num_bands = num_bands
+        self.band_bits = 64 // num_bands
+        self.generation = generation
+        self.orders = np.empty((num_bands, len(self.hashes)), dtype=np.int64)
+        self.sorted_keys = np.empty((num_bands, len(self.hashes)), dtype=np.uint64)
+        for band in range(num_bands):
+            keys = self._band_keys(self.hashes, band)
+            order = np.argsort(keys, kind="stable")
+            self.orders[band] = order
+            self.sorted_keys[band] = keys[order]
+
+    def _band_keys(self, values, band):
+        mask = np.uint64((1 << self.band_bits) - 1)
+        return (values >> np.uint64(band * self.band_bits)) & mask
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def query(self, value, threshold):
+        """
+        查找与 value 汉明距离不超过 threshold 的所有哈希
+        :return: 命中的下标数组（升序），可通过 self.ids 转换为目录库 id
+        """
+        value = np.uint64(value)
+        radius = threshold // self.num_bands
+        if radius > MAX_PROBE_RADIUS:
+            return np.flatnonzero(popcount64(self.hashes ^ value) <= threshold)
+
+        candidates = []
+        for band in range(self.num_bands):
+            probes = self._band_keys(value, band) ^ _flip_masks(radius, self.band_bits)
+            lefts = np.searchsorted(self.sorted_keys[band], probes, side="left")
+            rights = np.searchsorted(self.sorted_keys[band], probes, side="right")
+            lengths = rights - lefts
+            total = int(lengths.sum())
+            if total:
+                # 把所有 [left, right) 区间展开为下标
+                starts = np.repeat(lefts - np.cumsum(lengths) + lengths, lengths)
+                candidates.append(self.orders[band][starts + np.arange(total)])
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(candidates))
+        return candidates[popcount64(self.hashes[candidates] ^ value) <= threshold]
+
+    def append(self, hashes, ids):
+        """
+        追加哈希：新哈希按段值排序后用 searchsorted 合并进各段已有的有序数组，不重新排序已有的哈希，
+        耗时与索引大小成线性关系。追加后的索引不再对应某个修改代数。
+        """
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        start = len(self.hashes)
+        self.hashes = np.concatenate([self.hashes, hashes])
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        orders, sorted_keys = [], []
+        for band in range(self.num_bands):
+            keys = self._band_keys(hashes, band)
+            order = np.argsort(keys, kind="stable")
+            keys = keys[order]
+            positions = np.searchsorted(self.sorted_keys[band], keys, side="right")
+            sorted_keys.append(np.insert(self.sorted_keys[band], positions, keys))
+            orders.append(np.insert(self.orders[band], positions, order + start))
+        self.orders = np.stack(orders)
+        self.sorted_keys = np.stack(sorted_keys)
+        self.generation = None
+
+    def save(self, index_path):
+        np.savez(index_path, hashes=self.hashes, ids=self.ids, orders=self.orders, sorted_keys=self.sorted_keys,
+                 num_bands=self.num_bands, generation=-1 if self.generation is None else self.generation)
+
+    @classmethod
+    def load(cls, index_path):
+        with np.load(index_path) as data:
+            index = cls.__new__(cls)
+            index.hashes = data["hashes"]
+            index.ids = data["ids"]
+            index.orders = data["orders"]
+            index.sorted_keys = data["sorted_keys"]
+            index.num_bands = int(data["num_bands"])
+            index.band_bits = 64 // index.num_bands
+            generation = int(data["generation"])
+            index.generation = None if generation < 0 else generation
+        return index
+
+    @classmethod
+    def from_store(cls, store, num_bands=DEFAULT_BANDS, generation=None):
+        """
+        由 HashStore 建立索引，generation 为空时使用读取 HashStore 时的修改代数
+        """
+        generation = store.generation if generation is None else generation
+        return cls(store.hashes, store.ids, num_bands=num_bands, generation=generation)
+
+
+def index_path(db_path, hash_method):
+    """
+    返回目录库某种哈希的索引文件路径，例如 处理总文件.dhash.mih.npz
+    """
+    return f"{os.path.splitext(db_path)[0]}.{hash_method}.mih.npz"
+
+
+def load_index(db_path, hash_method, num_bands=DEFAULT_BANDS, store=None):
+    """
+    加载目录库某种哈希的近邻索引：索引文件存在且该哈希之后没有修改时直接加载，否则重建并保存。
+    MD5、文件属性的写入和没有该哈希的文件的删除标记变化不会使索引失效。
+    :param store: 已读取的 HashStore，提供时按其修改代数判断，并直接用它重建，索引与其内容一致
+    """
+    path = index_path(db_path, hash_method)
+    if store is not None:
+        generation = store.generation
+    else:
+        with Catalog(db_path) as catalog:
+            generation = catalog.generation(hash_method)
+
+    if os.path.exists(path):
+        index = MultiIndexHash.load(path)
+        if index.num_bands == num_bands:
+            if index.generation == generation:
+                print(f"已加载 {hash_method} 索引: {path}")
+                return index
+            # 增量聚类追加过的索引没有修改代数，内容与目录库一致时（只有新增）直接使用
+            if (index.generation is None and store is not None and np.array_equal(index.ids, store.ids)
+                    and np.array_equal(index.hashes, store.hashes)):
+                index.generation = generation
+                index.save(path)
+                print(f"已加载 {hash_method} 索引: {path}")
+                return index
+
+    print(f"正在建立 {hash_method} 索引...")
+    index = MultiIndexHash.from_store(store if store is not None else HashStore.from_catalog(db_path, hash_method),
+                                      num_bands)
+    index.save(path)
+    print(f"{hash_method} 索引已保存到 {path}")
+    return index
@@ -0,0 +1,54 @@
+import numpy as np
+
+from common.catalog import Catalog
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    # NumPy 2.0 以前没有 bitwise_count，按字节查表
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(values):
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+
+def popcount64(values):
+    """
+    计算 uint64 数组每个元素中 1 的个数
+    """
+    return _popcount(np.ascontiguousarray(values, dtype=np.uint64))
+
+
+class HashStore:
+    """
+    按位打包的 imagehash 数组：每个 64 位哈希存为一个 uint64，
+    汉明距离由近邻索引和聚类用异或加 popcount64 向量化计算。
+    """
+
+    def __init__(self, hashes, rows, ids=None, generation=None):
+        """
+        :param hashes: 哈希整数序列
+        :param rows: 与哈希一一对应的文件信息（2_1 的 CSV 行格式）
+        :param ids: 与哈希一一对应的目录库 id
+        :param generation: 读取时目录库中该哈希的修改代数
+        """
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.rows = rows
+        self.ids = np.asarray(ids if ids is not None else range(len(rows)), dtype=np.int64)
+        self.generation = generation
+
+    @classmethod
+    def from_catalog(cls, db_path, hash_method):
+        """
+        按 id 顺序从目录库读取所有未删除文件的指定哈希，同时在同一读事务中读取该哈希的修改代数
+        """
+        with Catalog(db_path) as catalog, catalog.snapshot():
+            generation = catalog.generation(hash_method)
+            items = list(catalog.iter_imagehash_items(hash_method))
+        rows = [row for _, row in items]
+        hashes = np.fromiter((int(row["imagehash"], 16) for row in rows), dtype=np.uint64, count=len(rows))
+        ids = np.fromiter((file_id for file_id, _ in items), dtype=np.int64, count=len(items))
+        return cls(hashes, rows, ids, generation)
+
+    def __len__(self):
+        return len(self.hashes)
@@ -0,0 +1,106 @@
+import hashlib
+import mmap
+import os
+import threading
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# 默认每次读取 1MB，减少 4KB 小块读取带来的系统调用次数
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+# 每个线程复用一块读取缓冲区
+_local = threading.local()
+
+
+def _new_blake2b():
+    # 输出 16 字节，与 MD5 长度一致
+    return hashlib.blake2b(digest_size=16)
+
+
+_ALGORITHMS = {
+    "md5": hashlib.md5,
+    "blake2b": _new_blake2b,
+}
+if xxhash is not None:
+    _ALGORITHMS["xxhash"] = xxhash.xxh3_128
+if blake3 is not None:
+    _ALGORITHMS["blake3"] = blake3.blake3
+
+
+def available_algorithms():
+    """
+    返回当前环境可用的摘要算法（xxhash、blake3 需要安装对应模块）
+    """
+    return list(_ALGORITHMS)
+
+
+def new_hasher(algorithm="md5"):
+    """
+    创建指定算法的摘要对象
+    """
+    if algorithm not in _ALGORITHMS:
+        raise ValueError(f"不支持的摘要算法: {algorithm}，可用算法: {available_algorithms()}")
+    return _ALGORITHMS[algorithm]()
+
+
+def _get_buffer(buffer_size):
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None or len(buffer) != buffer_size:
+        buffer = bytearray(buffer_size)
+        _local.buffer = buffer
+    return buffer
+
+
+def update_from_file(hasher, f, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    用 readinto 将文件剩余内容读入复用的缓冲区并更新摘要
+    :return: 读取的字节数
+    """
+    buffer = _get_buffer(buffer_size)
+    view = memoryview(buffer)
+    read_bytes = 0
+    while True:
+        n = f.readinto(buffer)
+        if not n:
+            break
+        hasher.update(view[:n])
+        read_bytes += n
+    return read_bytes
+
+
+def calculate_digest(file_path, algorithm="md5", buffer_size=DEFAULT_BUFFER_SIZE, use_mmap=False):
+    """
+    计算文件内容摘要
+    :param file_path: 文件路径
+    :param algorithm: 摘要算法（md5、blake2b，以及已安装时的 xxhash、blake3）
+    :param buffer_size: 每次读取的字节数
+    :param use_mmap: 是否使用内存映射读取
+    :return: 十六进制摘要，读取失败时返回 None
+    """
+    hasher = new_hasher(algorithm)
+    try:
+        with open(file_path, "rb", buffering=0) as f:
+            if use_mmap and os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    hasher.update(mm)
+            else:
+                update_from_file(hasher, f, buffer_size)
+        return hasher.hexdigest()
+    except Exception as e:
+        print(f"无法计算文件 {file_path} 的 {algorithm.upper()}，错误: {e}")
+        return None
+
+
+def calculate_md5(file_path):
+    """
+    计算文件的 MD5 值
+    """
+    return calculate_digest(file_path, "md5")
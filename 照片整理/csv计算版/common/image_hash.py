@@ -0,0 +1,113 @@
+import imghdr
+import io
+
+import imagehash
+import numpy as np
+from PIL import Image, ImageFile
+
+# 提高 Pillow 的像素限制（多进程模式下子进程也需要设置）
+Image.MAX_IMAGE_PIXELS = None
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# 解码后灰度图的最小短边：哈希最多只用到 32x32，留足余量以免缩小方式影响哈希值
+DECODE_SIZE = 256
+
+HASH_FUNCTIONS = {
+    "phash": imagehash.phash,
+    "average_hash": imagehash.average_hash,
+    "dhash": imagehash.dhash,
+}
+
+
+def hash_to_int(image_hash):
+    """
+    把 ImageHash 按位打包为整数（8x8 哈希即 64 位整数），十六进制形式与 str(image_hash) 一致
+    """
+    return int.from_bytes(np.packbits(image_hash.hash.flatten()).tobytes(), "big")
+
+
+def int_to_hex(value, bits=64):
+    """
+    把打包后的哈希整数转换为目录库中保存的十六进制字符串
+    """
+    return f"{value:0{bits // 4}x}"
+
+
+def hex_to_int(text):
+    """
+    把目录库中的十六进制哈希字符串转换为整数
+    """
+    return int(text, 16)
+
+
+def is_image_file(file_path):
+    """
+    判断文件是否为图片
+    :param file_path: 文件路径
+    :return: 如果是图片返回 True，否则返回 False
+    """
+    try:
+        return imghdr.what(file_path) is not None
+    except Exception as e:
+        print(f"无法判断文件类型: {file_path}, 错误: {e}")
+        return False
+
+
+def load_hash_image(image_path, data=None):
+    """
+    打开并解码图片一次，返回缩小后的灰度图，供所有哈希方法共用。
+    JPEG 通过 draft() 在解码阶段直接按 1/2、1/4、1/8 缩小并只解码灰度；
+    其他格式解码后同样按 2 的整数次幂缩小，短边不小于 DECODE_SIZE。
+    :param image_path: 图片路径
+    :param data: 已读入内存的文件内容（机械硬盘模式），为空时从文件读取
+    """
+    with Image.open(io.BytesIO(data) if data is not None else image_path) as img:
+        img.draft("L", (DECODE_SIZE, DECODE_SIZE))
+        gray = img.convert("L")
+    factor = 1
+    while min(gray.size) >= DECODE_SIZE * factor * 2:
+        factor *= 2
+    if factor > 1:
+        gray = gray.reduce(factor)
+    return gray
+
+
+def compute_hashes(file_path, hash_methods, data=None):
+    """
+    计算一个文件的多种哈希值：只判断一次文件类型、解码一次，所有方法共用同一张缩小的灰度图
+    :return: {哈希方法: 哈希整数}，不是图片或全部计算失败时为空字典
+    """
+    if data is None and not is_image_file(file_path):
+        print(f"文件 {file_path} 不是图片，跳过处理")
+        return {}
+
+    try:
+        gray = load_hash_image(file_path, data)
+    except Exception as e:
+        print(f"文件 {file_path} 获取 imagehash 异常: {e}")
+        return {}
+
+    hash_values = {}
+    for hash_method in hash_methods:
+        if hash_method not in HASH_FUNCTIONS:
+            print(f"未知的哈希方法: {hash_method}")
+            continue
+        try:
+            hash_values[hash_method] = hash_to_int(HASH_FUNCTIONS[hash_method](gray))
+        except Exception as e:
+            print(f"文件 {file_path} 计算 {hash_method} 异常: {e}")
+    return hash_values
+
+
+def hash_chunk(items, hash_methods):
+    """
+    多进程任务：计算一批文件的哈希值，只返回紧凑的结果以减少进程间传输。
+    :param items: [(文件路径, 文件内容或 None), ...]
+    :return: [(文件路径, (各方法的哈希整数或 None, ...)), ...]，不是图片的文件不返回
+    """
+    results = []
+    for file_path, data in items:
+        hash_values = compute_hashes(file_path, hash_methods, data)
+        if hash_values:
+            results.append((file_path, tuple(hash_values.get(method) for method in hash_methods)))
+    return results
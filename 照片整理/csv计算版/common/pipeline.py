@@ -0,0 +1,180 @@
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# 队列中的结束标记
+_DONE = object()
+
+
+def split_folders(folder_paths):
+    """
+    将分号分隔的文件夹字符串拆分为列表，去掉空白项
+    """
+    return [folder.strip() for folder in folder_paths.split(";") if folder.strip()]
+
+
+def walk_directories(folder_paths, with_stat=True, failed=None, failed_dirs=None):
+    """
+    遍历多个文件夹，逐个目录产出 (目录, [(文件名, 文件路径, 属性), ...])。
+    属性为 (大小, 修改时间纳秒, inode, 设备号)，with_stat=False 时为 None。
+    不在内存中保存整棵目录树。
+    :param failed: 集合，传入时记录无法读取属性的文件路径（例如 Windows 上被占用的文件）
+    :param failed_dirs: 集合，传入时记录无法列出内容的目录，调用方据此区分“读取失败”和“已不存在”
+    """
+    def on_error(error):
+        print(f"无法读取目录 {error.filename}，错误: {error}")
+        if failed_dirs is not None and error.filename:
+            failed_dirs.add(os.path.normpath(error.filename))
+
+    for folder in split_folders(folder_paths):
+        if not os.path.exists(folder) or not os.path.isdir(folder):
+            print(f"无效的文件夹路径: {folder}")
+            continue
+
+        for root, _, files in os.walk(folder, onerror=on_error):
+            entries = []
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                file_stat = None
+                if with_stat:
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError as e:
+                        print(f"无法读取文件 {file_path} 的属性，错误: {e}")
+                        if failed is not None:
+                            failed.add(file_path)
+                        continue
+                    file_stat = (stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev)
+                entries.append((file_name, file_path, file_stat))
+            yield root, entries
+
+
+def walk_files(folder_paths, with_stat=True):
+    """
+    遍历多个文件夹，逐个文件产出 (文件名, 文件目录, 文件路径, 属性)
+    """
+    for root, entries in walk_directories(folder_paths, with_stat=with_stat):
+        for file_name, file_path, file_stat in entries:
+            yield file_name, root, file_path, file_stat
+
+
+def run_pipeline(tasks, worker, num_workers=8, queue_size=1024):
+    """
+    生产者/消费者流水线：生产者线程遍历 tasks 放入有界队列，num_workers 个线程执行 worker，
+    结果按完成顺序逐个产出，由调用方（写入线程）边取边写。
+    两个队列都有上限，内存占用不随文件总数增长。worker 返回 None 的任务不产出结果。
+    :param tasks: 任务的可迭代对象（可以是生成器，在生产者线程中遍历）
+    :param worker: 处理单个任务的函数
+    :param num_workers: 工作线程数
+    :param queue_size: 任务队列和结果队列的最大长度
+    """
+    num_workers = num_workers or min(32, (os.cpu_count() or 1) + 4)
+    task_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def put(target, item):
+        # 调用方提前结束时不再阻塞
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for task in tasks:
+                if not put(task_queue, task):
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(num_workers):
+                put(task_queue, _DONE)
+
+    def work():
+        while not stop.is_set():
+            try:
+                task = task_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if task is _DONE:
+                break
+            try:
+                result = worker(task)
+            except Exception as e:
+                print(f"处理任务时出错: {e}")
+                continue
+            if result is not None and not put(result_queue, result):
+                break
+        put(result_queue, _DONE)
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    threads += [threading.Thread(target=work, daemon=True) for _ in range(num_workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < num_workers:
+            result = result_queue.get()
+            if result is _DONE:
+                finished += 1
+            else:
+                yield result
+    finally:
+        stop.set()
+
+    if errors:
+        raise errors[0]
+
+
+def iter_chunks(tasks, chunk_size):
+    """
+    把任务按 chunk_size 个一批分组产出
+    """
+    chunk = []
+    for task in tasks:
+        chunk.append(task)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_process_pipeline(tasks, chunk_worker, num_workers=None, chunk_size=64, max_pending=None,
+                         initializer=None, initargs=()):
+    """
+    多进程流水线：适合解码图片等受 GIL 限制的计算。任务按 chunk_size 个一批提交给进程池，
+    同时最多 max_pending 批在途，结果按批完成顺序逐个产出。
+    :param tasks: 任务的可迭代对象（在当前线程中遍历）
+    :param chunk_worker: 处理一批任务并返回结果列表的函数，必须定义在模块顶层（可用 functools.partial 绑定参数）
+    :param num_workers: 进程数，默认为 CPU 核数
+    :param chunk_size: 每批任务数
+    :param max_pending: 最多在途的批数，默认为进程数的 2 倍
+    :param initializer: 每个进程启动时调用的函数，用于加载各批共用的数据
+    :param initargs: initializer 的参数
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    max_pending = max_pending or num_workers * 2
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=initializer, initargs=initargs) as executor:
+        pending = set()
+        try:
+            for chunk in iter_chunks(tasks, chunk_size):
+                pending.add(executor.submit(chunk_worker, chunk))
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from future.result()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        finally:
+            for future in pending:
+                future.cancel()
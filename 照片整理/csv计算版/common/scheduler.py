@@ -0,0 +1,201 @@
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+
+from common.pipeline import split_folders
+
+# 队列中的结束标记
+_DONE = object()
+
+
+def group_folders_by_device(folder_paths):
+    """
+    按所在设备（st_dev）对分号分隔的文件夹分组。
+    :return: {设备号: "文件夹1;文件夹2"}，无效的文件夹会被跳过
+    """
+    groups = defaultdict(list)
+    for folder in split_folders(folder_paths):
+        if not os.path.exists(folder) or not os.path.isdir(folder):
+            print(f"无效的文件夹路径: {folder}")
+            continue
+        groups[os.stat(folder).st_dev].append(folder)
+    return {device: ";".join(folders) for device, folders in groups.items()}
+
+
+class AdaptiveConcurrency:
+    """
+    按吞吐量爬山调整并发数：吞吐量比上次提升超过 5% 时继续沿当前方向调整（增加时翻倍、减少时减半），
+    下降超过 5% 时反向，变化不大时保持不变。
+    机械硬盘通常会收敛到 1~2 个读取线程，固态硬盘会逐步增加到吞吐量不再提升为止。
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, tolerance=0.05):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.limit = min(max(initial, minimum), self.maximum)
+        self.tolerance = tolerance
+        self.direction = 1
+        self.last_throughput = None
+
+    def _step(self):
+        if self.direction > 0:
+            self.limit = min(self.maximum, self.limit * 2)
+        else:
+            self.limit = max(self.minimum, self.limit // 2)
+
+    def update(self, throughput):
+        """
+        根据最近一个周期的吞吐量返回新的并发数
+        """
+        if self.last_throughput is None:
+            self._step()
+        elif throughput > self.last_throughput * (1 + self.tolerance):
+            self._step()
+        elif throughput < self.last_throughput * (1 - self.tolerance):
+            self.direction = -self.direction
+            self._step()
+        self.last_throughput = throughput
+        return self.limit
+
+
+class _DevicePool:
+    """
+    单个设备的工作线程组：一个生产者线程遍历该设备的任务，工作线程数由 AdaptiveConcurrency 控制
+    """
+
+    def __init__(self, device, tasks, worker, result_queue, stop, size_of, controller, queue_size):
+        self.device = device
+        self.source = tasks
+        self.worker = worker
+        self.result_queue = result_queue
+        self.stop = stop
+        self.size_of = size_of
+        self.controller = controller
+        self.tasks = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.workers = {}
+        self.source_done = False
+        self.finished = False
+        self.completed = 0  # 已完成的字节数（未提供 size_of 时为文件数）
+        self.errors = []
+
+    def _put(self, target, item):
+        while not self.stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def start(self):
+        # 先启动工作线程，保证由最后退出的工作线程放入结束标记
+        self.resize(self.controller.limit)
+        threading.Thread(target=self._produce, daemon=True).start()
+
+    def resize(self, limit):
+        """
+        增加工作线程到 limit 个；减少时多余的线程在完成当前任务后自行退出。
+        任务已全部取出后不再启动新线程，让现有线程自然结束
+        """
+        with self.lock:
+            if self.finished or self.source_done and self.tasks.empty():
+                return
+            for index in range(limit):
+                if index not in self.workers:
+                    thread = threading.Thread(target=self._work, args=(index,), daemon=True)
+                    self.workers[index] = thread
+                    thread.start()
+
+    def _produce(self):
+        try:
+            for task in self.source:
+                if not self._put(self.tasks, task):
+                    break
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            self.source_done = True
+
+    def _work(self, index):
+        while not self.stop.is_set() and index < self.controller.limit:
+            try:
+                task = self.tasks.get(timeout=0.1)
+            except queue.Empty:
+                if self.source_done:
+                    break
+                continue
+            try:
+                result = self.worker(task)
+            except Exception as e:
+                print(f"处理任务时出错: {e}")
+                result = None
+            with self.lock:
+                self.completed += self.size_of(task) if self.size_of else 1
+            if result is not None and not self._put(self.result_queue, result):
+                break
+
+        with self.lock:
+            del self.workers[index]
+            last = not self.workers and (self.source_done and self.tasks.empty() or self.stop.is_set())
+            if last:
+                self.finished = True
+        if last:
+            self._put(self.result_queue, _DONE)
+
+
+def run_device_pipeline(sources, worker, size_of=None, initial_workers=4, min_workers=1, max_workers=64,
+                        queue_size=1024, interval=2.0):
+    """
+    按设备调度的流水线：每个设备有独立的遍历线程、任务队列和工作线程组，不同设备并行读取，
+    每个设备的并发数根据实测吞吐量在 [min_workers, max_workers] 之间自动调整。
+    结果按完成顺序逐个产出，由调用方（写入线程）边取边写。
+    :param sources: {设备号: 任务的可迭代对象}，可用 group_folders_by_device 分组后为每组创建
+    :param worker: 处理单个任务的函数，返回 None 的任务不产出结果
+    :param size_of: 返回任务字节数的函数，用于计算吞吐量；为空时按文件数计算
+    :param initial_workers: 每个设备的初始并发数
+    :param min_workers: 每个设备的最小并发数
+    :param max_workers: 每个设备的最大并发数
+    :param queue_size: 每个队列的最大长度
+    :param interval: 调整并发数的周期（秒）
+    """
+    result_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    pools = [
+        _DevicePool(device, tasks, worker, result_queue, stop, size_of,
+                    AdaptiveConcurrency(initial_workers, min_workers, max_workers), queue_size)
+        for device, tasks in sources.items()
+    ]
+    for pool in pools:
+        pool.start()
+
+    def monitor():
+        last = {pool.device: (time.monotonic(), 0) for pool in pools}
+        while not stop.wait(interval):
+            for pool in pools:
+                if pool.finished:
+                    continue
+                now, completed = time.monotonic(), pool.completed
+                last_time, last_completed = last[pool.device]
+                last[pool.device] = (now, completed)
+                pool.resize(pool.controller.update((completed - last_completed) / (now - last_time)))
+
+    threading.Thread(target=monitor, daemon=True).start()
+
+    try:
+        finished = 0
+        while finished < len(pools):
+            result = result_queue.get()
+            if result is _DONE:
+                finished += 1
+            else:
+                yield result
+    finally:
+        stop.set()
+
+    for pool in pools:
+        print(f"设备 {pool.device} 最终并发数: {pool.controller.limit}")
+        if pool.errors:
+            raise pool.errors[0]
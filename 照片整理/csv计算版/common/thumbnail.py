@@ -0,0 +1,402 @@
+import csv
+import hashlib
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
+import rawpy
+from PIL import Image, ImageFile, ImageOps
+
+from common.pipeline import run_process_pipeline
+
+Image.MAX_IMAGE_PIXELS = None
+ImageFile.LOAD_TRUNCATED_IMAGES = True
+
+# 页面上的图片宽 180px，按 2 倍生成以适应高分屏
+THUMBNAIL_SIZE = 360
+
+# 允许请求的缩略图边长范围
+MIN_SIZE = 32
+MAX_SIZE = 4096
+
+# 需要用 rawpy 解码的相机 RAW 格式
+RAW_EXTENSIONS = (".nef", ".cr3")
+
+JPEG_QUALITY = 85
+
+# EXIF 方向标签
+ORIENTATION_TAG = 0x0112
+
+# 磁盘缓存默认上限 2GB，内存缓存默认上限 64MB
+DEFAULT_DISK_BYTES = 2 * 1024 * 1024 * 1024
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+
+# 记住的转换失败数，避免前端轮询时反复转换同一个坏文件
+MAX_FAILURES = 1024
+
+# 转换失败记录的有效秒数，过期后重新转换，文件被占用、共享暂时断开等临时错误不会一直失败
+FAILURE_TTL_SECONDS = 60
+
+
+def clamp_size(size):
+    return max(MIN_SIZE, min(MAX_SIZE, int(size)))
+
+
+def thumbnail_key(file_path, size):
+    """
+    缓存键：由文件路径、缩略图边长和文件的修改时间、大小计算，文件被修改后自动失效。
+    文件不存在时抛出 OSError。
+    """
+    stat = os.stat(file_path)
+    text = f"{file_path}|{size}|{stat.st_mtime_ns}|{stat.st_size}"
+    return hashlib.md5(text.encode("utf-8")).hexdigest()
+
+
+# LibRaw 的 flip 值对应的旋转，rawpy 的 postprocess() 会自动处理，内嵌预览图需要自己旋转
+_RAW_FLIP_TRANSPOSE = {
+    3: Image.Transpose.ROTATE_180,
+    5: Image.Transpose.ROTATE_90,
+    6: Image.Transpose.ROTATE_270,
+}
+
+
+def _embedded_preview(raw, size):
+    """
+    读取 RAW 文件中相机内嵌的预览图，没有预览图或预览图小于 size 时返回 None
+    """
+    try:
+        thumb = raw.extract_thumb()
+    except (rawpy.LibRawNoThumbnailError, rawpy.LibRawUnsupportedThumbnailError):
+        return None
+    if thumb.format == rawpy.ThumbFormat.JPEG:
+        img = Image.open(io.BytesIO(thumb.data))
+        img.draft("RGB", (size, size))
+        has_orientation = img.getexif().get(ORIENTATION_TAG, 1) != 1
+    elif thumb.format == rawpy.ThumbFormat.BITMAP:
+        img = Image.fromarray(thumb.data)
+        has_orientation = False
+    else:
+        return None
+    if max(img.size) < size:
+        return None
+    # 内嵌 JPEG 自带方向信息时由 exif_transpose 处理，否则按 RAW 文件的方向旋转
+    transpose = _RAW_FLIP_TRANSPOSE.get(raw.sizes.flip)
+    if transpose is not None and not has_orientation:
+        img = img.transpose(transpose)
+    return img
+
+
+def open_raw_image(raw_path, size=THUMBNAIL_SIZE):
+    """
+    打开相机 RAW 文件：优先使用相机内嵌的 JPEG 预览图（不需要解码 RAW 数据），
+    没有足够大的预览图时才用 rawpy 以半尺寸解码。
+    """
+    with rawpy.imread(raw_path) as raw:
+        img = _embedded_preview(raw, size)
+        if img is None:
+            img = Image.fromarray(raw.postprocess(half_size=True))
+    return img
+
+
+def image_dimensions(file_path):
+    """
+    读取图片的宽高（按 EXIF 或 RAW 的方向旋转后），只读取文件头，不解码像素；无法识别时返回 None
+    """
+    try:
+        if file_path.lower().endswith(RAW_EXTENSIONS):
+            with rawpy.imread(file_path) as raw:
+                width, height = raw.sizes.width, raw.sizes.height
+                rotated = raw.sizes.flip in (5, 6)
+        else:
+            with Image.open(file_path) as img:
+                width, height = img.size
+                rotated = img.getexif().get(ORIENTATION_TAG, 1) in (5, 6, 7, 8)
+    except Exception:
+        return None
+    return (height, width) if rotated else (width, height)
+
+
+def render_thumbnail(file_path, size=THUMBNAIL_SIZE):
+    """
+    生成缩略图，返回 JPEG 字节。
+    JPEG 通过 draft() 在解码阶段直接按 1/2、1/4、1/8 缩小，其他格式解码后缩小；
+    按 EXIF 方向旋转，与浏览器直接显示原图时的方向一致。
+    """
+    if file_path.lower().endswith(RAW_EXTENSIONS):
+        img = open_raw_image(file_path, size)
+    else:
+        img = Image.open(file_path)
+        img.draft("RGB", (size, size))
+    with img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        output = io.BytesIO()
+        img.save(output, "JPEG", quality=JPEG_QUALITY)
+    return output.getvalue()
+
+
+class ThumbnailCache:
+    """
+    两级缩略图缓存：
+    - 磁盘缓存：cache_dir 下每个缩略图一个文件，总大小不超过 max_disk_bytes，按最近使用淘汰，
+      命中时更新文件修改时间，重启后按修改时间恢复使用顺序；
+    - 内存缓存：最近使用的缩略图字节，总大小不超过 max_memory_bytes。
+    request() 在有上限的线程池中生成缩略图，同一缩略图同时只转换一次。
+    """
+
+    def __init__(self, cache_dir, max_disk_bytes=DEFAULT_DISK_BYTES, max_memory_bytes=DEFAULT_MEMORY_BYTES,
+                 num_workers=None):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.executor = None
+        self.lock = threading.Lock()
+        self.in_flight = {}  # 缓存键 -> 正在进行的转换 Future
+        self.failures = OrderedDict()  # 缓存键 -> (失败时间, 异常类型名, 错误信息)
+        self.memory = OrderedDict()  # 缓存键 -> 缩略图字节
+        self.memory_bytes = 0
+        self.disk = OrderedDict()  # 缓存键 -> 文件大小，按使用时间从旧到新
+        self.disk_bytes = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_file() and entry.name.endswith(".jpg"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_bytes += size
+        with self.lock:
+            self._evict_disk()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.jpg")
+
+    def _remember(self, key, data):
+        # 放入内存缓存并按上限淘汰，调用方持有锁
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+        if len(data) > self.max_memory_bytes:
+            return
+        self.memory[key] = data
+        self.memory_bytes += len(data)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        # 按最近使用顺序删除最旧的缩略图文件，调用方持有锁
+        while self.disk_bytes > self.max_disk_bytes and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def lookup(self, key):
+        """
+        查找缓存的缩略图，未命中时返回 None
+        """
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                if key in self.disk:
+                    self.disk.move_to_end(key)
+                return data
+            if key not in self.disk:
+                return None
+            self.disk.move_to_end(key)
+        try:
+            with open(self._path(key), "rb") as file:
+                data = file.read()
+            os.utime(self._path(key))
+        except OSError:
+            # 文件已被删除（如另一个进程淘汰），当作未命中
+            with self.lock:
+                size = self.disk.pop(key, None)
+                if size is not None:
+                    self.disk_bytes -= size
+            return None
+        with self.lock:
+            self._remember(key, data)
+        return data
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.memory or key in self.disk
+
+    def store(self, key, data, remember=True):
+        """
+        把缩略图写入磁盘缓存和内存缓存。先写临时文件再改名，中途中断不会留下不完整的缩略图。
+        :param remember: 是否放入内存缓存，批量预生成时为 False，避免挤掉正在查看的缩略图
+        """
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        with self.lock:
+            if key in self.disk:
+                self.disk_bytes -= self.disk[key]
+            self.disk[key] = len(data)
+            self.disk_bytes += len(data)
+            self._evict_disk()
+            if remember:
+                self._remember(key, data)
+
+    def get(self, file_path, size=THUMBNAIL_SIZE):
+        """
+        返回文件的缩略图 JPEG 字节，未缓存时生成并缓存
+        """
+        key = thumbnail_key(file_path, size)
+        data = self.lookup(key)
+        if data is None:
+            data = render_thumbnail(file_path, size)
+            self.store(key, data)
+        return data
+
+    def _render_and_store(self, file_path, key, size):
+        data = render_thumbnail(file_path, size)
+        self.store(key, data)
+        return data
+
+    def _finish(self, key, future):
+        # 转换结束：记录失败并移出进行中的转换，成功的结果已在移出前写入缓存
+        with self.lock:
+            error = future.exception()
+            if error is not None:
+                self.failures[key] = (time.monotonic(), type(error).__name__, str(error))
+                if len(self.failures) > MAX_FAILURES:
+                    self.failures.popitem(last=False)
+            self.in_flight.pop(key, None)
+
+    def request(self, file_path, size=THUMBNAIL_SIZE, timeout=0):
+        """
+        非阻塞地获取缩略图：已缓存时直接返回 JPEG 字节；否则在线程池中开始转换（已在转换的不重复开始），
+        最多等待 timeout 秒，仍未完成时返回 None，由调用方稍后再请求。
+        转换失败时抛出转换的异常；之后 FAILURE_TTL_SECONDS 秒内的请求直接抛出 RuntimeError，
+        不重复转换，过期后或文件修改后重新转换。
+        """
+        key = thumbnail_key(file_path, size)
+        data = self.lookup(key)
+        if data is not None:
+            return data
+
+        started = False
+        with self.lock:
+            failure = self.failures.get(key)
+            if failure is not None:
+                failed_at, error_type, message = failure
+                if time.monotonic() - failed_at < FAILURE_TTL_SECONDS:
+                    raise RuntimeError(f"缩略图转换失败（{error_type}）: {message}")
+                del self.failures[key]
+            future = self.in_flight.get(key)
+            if future is None and key not in self.disk and key not in self.memory:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="thumbnail")
+                future = self.executor.submit(self._render_and_store, file_path, key, size)
+                self.in_flight[key] = future
+                started = True
+        if future is None:
+            # 查找后、加锁前另一个转换刚好完成
+            return self.lookup(key)
+        if started:
+            # 在锁外注册，转换已完成时回调会在当前线程立即执行
+            future.add_done_callback(partial(self._finish, key))
+
+        wait([future], timeout=timeout)
+        if not future.done():
+            return None
+        return future.result()
+
+
+def read_group_paths(csv_path):
+    """
+    按页面的审阅顺序读取分组 CSV 中的文件路径：逐行读取，行内按表头顺序取含“文件路径”的列，
+    与前端页面的显示顺序一致。支持 2_2 的分组 CSV 和 1_3 的 same_files CSV；
+    旧版 same_files 没有文件路径列时，由“文件目录N”和“文件名N”拼出路径。
+    """
+    with open(csv_path, mode="r", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        headers = next(reader, [])
+        path_columns = [i for i, header in enumerate(headers) if "文件路径" in header]
+        if path_columns:
+            for row in reader:
+                for i in path_columns:
+                    if i < len(row) and row[i].strip():
+                        yield row[i].strip()
+            return
+
+        pairs = [(headers.index(header), headers.index(header.replace("文件目录", "文件名")))
+                 for header in headers
+                 if header.startswith("文件目录") and header.replace("文件目录", "文件名") in headers]
+        for row in reader:
+            for directory_column, name_column in pairs:
+                if max(directory_column, name_column) < len(row) and row[name_column].strip():
+                    yield os.path.join(row[directory_column].strip(), row[name_column].strip())
+
+
+def render_chunk(tasks, size):
+    """
+    多进程任务：生成一批缩略图
+    :param tasks: [(文件路径, 缓存键), ...]
+    :return: [(文件路径, 缓存键, JPEG 字节或 None, 错误信息或 None), ...]
+    """
+    results = []
+    for file_path, key in tasks:
+        try:
+            results.append((file_path, key, render_thumbnail(file_path, size), None))
+        except Exception as e:
+            results.append((file_path, key, None, str(e)))
+    return results
+
+
+def prewarm_thumbnails(cache, file_paths, size=THUMBNAIL_SIZE, num_workers=None, progress=None):
+    """
+    批量预生成缩略图：跳过已缓存和不存在的文件，其余按给定顺序提交给进程池生成，
+    生成结果由当前进程写入缓存，缓存的使用顺序和容量统计保持一致。
+    :param cache: ThumbnailCache
+    :param file_paths: 按审阅顺序排列的文件路径
+    :param progress: 进度字典，生成过程中原地更新，供其他线程读取
+    :return: 进度字典 {"总数", "已完成", "已生成", "已缓存", "不存在", "失败"}
+    """
+    progress = progress if progress is not None else {}
+    file_paths = list(dict.fromkeys(file_paths))
+    progress.update({"总数": len(file_paths), "已完成": 0, "已生成": 0, "已缓存": 0, "不存在": 0, "失败": 0})
+
+    def pending_tasks():
+        for file_path in file_paths:
+            try:
+                key = thumbnail_key(file_path, size)
+            except OSError:
+                progress["不存在"] += 1
+                progress["已完成"] += 1
+                continue
+            if cache.contains(key):
+                progress["已缓存"] += 1
+                progress["已完成"] += 1
+                continue
+            yield file_path, key
+
+    results = run_process_pipeline(pending_tasks(), partial(render_chunk, size=size),
+                                   num_workers=num_workers, chunk_size=8)
+    for file_path, key, data, error in results:
+        if error is None:
+            cache.store(key, data, remember=False)
+            progress["已生成"] += 1
+        else:
+            print(f"文件 {file_path} 生成缩略图失败: {error}")
+            progress["失败"] += 1
+        progress["已完成"] += 1
+    return progress
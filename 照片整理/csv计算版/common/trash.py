@@ -0,0 +1,109 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from send2trash import send2trash
+from tqdm import tqdm
+
+from common.catalog import Catalog
+
+# 每次调用 send2trash 传入的最大文件数
+BATCH_SIZE = 256
+
+# 每个设备同时进行的回收站操作数，回收站操作受文件系统元数据更新限制，线程多了只会互相争用
+DEFAULT_WORKERS_PER_DEVICE = 2
+
+
+def _device_of(directory):
+    try:
+        return os.stat(directory).st_dev
+    except OSError:
+        return None
+
+
+def _trash_batch(paths):
+    """
+    把一批同目录的文件一次移入回收站。先排除不存在的文件；整批失败时，
+    已被这一批移入回收站的文件算作已删除，其余的逐个重试，得到每个文件的结果。
+    :return: [(文件路径, None 或错误信息), ...]，文件不存在时错误信息为 FileNotFoundError
+    """
+    outcomes = [(path, FileNotFoundError(path)) for path in paths if not os.path.lexists(path)]
+    existing = [path for path in paths if os.path.lexists(path)] if outcomes else paths
+    if not existing:
+        return outcomes
+    try:
+        send2trash(existing)
+        return outcomes + [(path, None) for path in existing]
+    except Exception:
+        pass
+
+    for path in existing:
+        if not os.path.lexists(path):
+            outcomes.append((path, None))
+            continue
+        try:
+            send2trash(path)
+            outcomes.append((path, None))
+        except Exception as e:
+            outcomes.append((path, e))
+    return outcomes
+
+
+def _trash_device(batches, workers, progress_bar):
+    outcomes = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in as_completed([executor.submit(_trash_batch, batch) for batch in batches]):
+            batch_outcomes = future.result()
+            progress_bar.update(len(batch_outcomes))
+            outcomes.extend(batch_outcomes)
+    return outcomes
+
+
+def trash_files(file_paths, db_path=None, workers_per_device=DEFAULT_WORKERS_PER_DEVICE, batch_size=BATCH_SIZE):
+    """
+    把文件批量移入回收站：按目录分批，每批调用一次 send2trash，
+    不同设备并行处理，每个设备的并发数有上限。结束后把结果一次性写回目录库。
+    :param file_paths: 要删除的文件路径
+    :param db_path: 目录库路径，为空时不更新目录库；已删除和本来就不存在的文件都标记为已删除
+    :param workers_per_device: 每个设备同时进行的回收站操作数
+    :param batch_size: 每次调用 send2trash 的最大文件数
+    :return: (已删除的文件路径, 不存在的文件路径, {删除失败的文件路径: 错误})
+    """
+    # 按设备、目录分批
+    batches_by_device = defaultdict(list)
+    paths_by_directory = defaultdict(list)
+    for path in dict.fromkeys(file_paths):
+        paths_by_directory[os.path.dirname(path)].append(path)
+    for directory, paths in paths_by_directory.items():
+        device = _device_of(directory)
+        for start in range(0, len(paths), batch_size):
+            batches_by_device[device].append(paths[start:start + batch_size])
+
+    deleted_paths, missing_paths, failures = [], [], {}
+    total = sum(len(paths) for paths in paths_by_directory.values())
+    with tqdm(total=total, desc="删除文件", unit="文件") as progress_bar:
+        with ThreadPoolExecutor(max_workers=max(len(batches_by_device), 1)) as executor:
+            futures = [executor.submit(_trash_device, batches, workers_per_device, progress_bar)
+                       for batches in batches_by_device.values()]
+            for future in futures:
+                for path, error in future.result():
+                    if error is None:
+                        deleted_paths.append(path)
+                    elif isinstance(error, FileNotFoundError):
+                        missing_paths.append(path)
+                    else:
+                        failures[path] = error
+
+    for path, error in failures.items():
+        print(f"删除文件失败: {path}，错误: {error}")
+
+    # 只更新目录库中被删除文件的行
+    if db_path and (deleted_paths or missing_paths):
+        try:
+            with Catalog(db_path) as catalog:
+                catalog.mark_deleted(deleted_paths + missing_paths)
+            print(f"目录库已更新: {db_path}")
+        except Exception as e:
+            print(f"更新目录库失败: {e}")
+
+    return deleted_paths, missing_paths, failures
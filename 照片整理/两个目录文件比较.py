@@ -1,22 +1,11 @@
 import os
-import hashlib
+import sys
 import csv
 import send2trash
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def calculate_md5(file_path):
-    """
-    计算文件的 MD5 值
-    """
-    hash_md5 = hashlib.md5()
-    try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    except Exception as e:
-        print(f"无法计算文件 {file_path} 的 MD5，错误: {e}")
-        return None
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "csv计算版"))
+from common.hashing import calculate_md5
 
 def get_files_with_md5(directory, num_threads):
     """
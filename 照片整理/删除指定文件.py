@@ -1,5 +1,8 @@
 import os
-from send2trash import send2trash
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "csv计算版"))
+from common.trash import trash_files
 
 def delete_jpg_files(directory):
     """
@@ -9,20 +12,18 @@ def delete_jpg_files(directory):
         print(f"无效的目录: {directory}")
         return 0  # 返回删除文件数为 0
 
-    deleted_count = 0
-
+    file_paths = []
     for root, _, files in os.walk(directory):
         for file_name in files:
             if file_name.endswith(".cfg"):
-                file_path = os.path.join(root, file_name)
-                try:
-                    send2trash(file_path)
-                    print(f"已移入回收站: {file_path}")
-                    deleted_count += 1
-                except Exception as e:
-                    print(f"无法删除文件 {file_path}，错误: {e}")
+                file_paths.append(os.path.join(root, file_name))
+
+    # 按目录批量移入回收站
+    deleted_paths, _, _ = trash_files(file_paths)
+    for file_path in deleted_paths:
+        print(f"已移入回收站: {file_path}")
 
-    return deleted_count
+    return len(deleted_paths)
 
 if __name__ == "__main__":
     input_directory = "J:\机械G\尘封的回忆"